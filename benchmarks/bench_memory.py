@@ -0,0 +1,48 @@
+"""Memory held by a profile's blocks: list of (text, wait_ms) tuples vs BlockList.
+
+Run from the repository root:
+
+    python benchmarks/bench_memory.py
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kzmacro.profile import BlockList  # noqa: E402
+
+SIZES = [10_000, 100_000, 1_000_000]
+KEYS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def recorded_events(n):
+    # Same shape the recorder produces: a fresh string per event
+    for i in range(n):
+        wait_ms = (i * 7919 % 250_000) / 1000
+        if i % 4 == 3:
+            yield f"Button.left {'Down' if i % 8 == 3 else 'Up'}", wait_ms
+        else:
+            yield f"Key {KEYS[i % 26]}", wait_ms
+
+
+def measure(build, n):
+    tracemalloc.start()
+    blocks = build(recorded_events(n))
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del blocks
+    return size
+
+
+def main():
+    print(f"{'steps':>10} {'tuple list':>12} {'BlockList':>12} {'ratio':>7}")
+    for n in SIZES:
+        as_list = measure(list, n)
+        as_blocks = measure(BlockList, n)
+        print(f"{n:>10} {as_list / 2**20:>10.1f}MB {as_blocks / 2**20:>10.1f}MB "
+              f"{as_list / as_blocks:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
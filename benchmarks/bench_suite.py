@@ -0,0 +1,271 @@
+"""Timing benchmarks for the record, render, persist and playback hot paths.
+
+Run from the repository root:
+
+    python benchmarks/bench_suite.py                    # writes benchmarks/results.json
+    python benchmarks/bench_suite.py --save-baseline    # also store it as the baseline
+    python benchmarks/bench_suite.py --sizes 1000       # quick run
+
+Every run is compared against benchmarks/baseline.json when it exists. Any
+metric that got worse than its baseline by more than --threshold is listed
+and the script exits with status 1. Runs headless: Qt uses the offscreen
+platform and input goes through FakeBackend.
+"""
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication, QFileDialog, QMessageBox  # noqa: E402
+
+import macro  # noqa: E402
+from kzmacro.backends import FakeBackend  # noqa: E402
+from kzmacro.profile import MacroProfile  # noqa: E402
+from kzmacro.runtime import MacroRuntime  # noqa: E402
+
+SIZES = (1_000, 10_000, 100_000)
+REPEATS = 3               # Timings keep the best of this many runs
+PLAYBACK_SPAN_S = 2.0     # Each playback run is spread over about this long
+DRAIN_EVERY = 4096        # Events fed between drains, like the 16 ms timer would
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_PATH = os.path.join(HERE, "results.json")
+BASELINE_PATH = os.path.join(HERE, "baseline.json")
+# Changes smaller than this are noise whatever the ratio says
+MIN_DELTA = {"s": 0.001, "ms": 0.25, "events/s": 0}
+KEYS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def synthetic_blocks(n, wait_ms=None):
+    for i in range(n):
+        wait = (i * 7919 % 250_000) / 1000 if wait_ms is None else wait_ms
+        if i % 4 == 3:
+            yield f"Button.left {'Down' if i % 8 == 3 else 'Up'}", wait
+        else:
+            yield f"Key {KEYS[i % 26]}", wait
+
+
+def make_profile(n, name="Bench", wait_ms=None):
+    profile = MacroProfile(name)
+    profile.add_blocks(synthetic_blocks(n, wait_ms))
+    return profile
+
+
+def best_of(fn, repeats=REPEATS):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def settle(editor):
+    # Recording journals every drain, which can start a background compaction;
+    # don't let it bleed into the next measurement
+    while editor.profile_library.is_compacting():
+        time.sleep(0.001)
+
+
+def result(name, steps, value, unit, better="lower", gate=True):
+    # gate=False metrics are reported but too noisy to fail a run over
+    return {"name": name, "steps": steps, "value": value, "unit": unit,
+            "better": better, "gate": gate}
+
+
+# -------------------------------------------------------
+#               BENCHMARKS
+# -------------------------------------------------------
+def bench_record(editor, backend, n):
+    editor.switch_profile(editor.profiles[0])
+    editor.record_filter.ignore_window = False  # Fake clicks land on the editor window
+
+    def run():
+        editor.start_record()
+        for i in range(n):
+            # Presses and releases alternate; the filter would drop a repeated press
+            pressed = i % 2 == 0
+            if i // 2 % 4 == 3:
+                backend.feed_click("Button.left", pressed)
+            else:
+                backend.feed_key(KEYS[i // 2 % 26], pressed)
+            if i % DRAIN_EVERY == DRAIN_EVERY - 1:
+                editor.drain_recording()
+        editor.stop_record()
+    elapsed = best_of(run)
+    assert len(editor.profiles[0].blocks) == n
+    return [result("record_ingest", n, n / elapsed, "events/s", "higher")]
+
+
+def bench_timeline(editor, app, n):
+    editor.profiles[1].blocks = make_profile(n).blocks
+
+    def run():
+        editor.switch_profile(editor.profiles[0])
+        app.processEvents()
+        start = time.perf_counter()
+        editor.switch_profile(editor.profiles[1])
+        app.processEvents()  # Lay out and paint the visible blocks
+        return time.perf_counter() - start
+    elapsed = min(run() for _ in range(REPEATS))
+    return [result("timeline_switch", n, elapsed, "s")]
+
+
+def bench_persist(editor, n, workdir):
+    editor.switch_profile(editor.profiles[0])
+    editor.profiles[0].blocks = make_profile(n).blocks
+    editor.profiles[1].blocks = []
+    results = []
+    for ext in ("json", "kzm"):
+        path = os.path.join(workdir, f"bench.{ext}")
+        QFileDialog.getSaveFileName = staticmethod(lambda *a, **k: (path, ""))
+        QFileDialog.getOpenFileName = staticmethod(lambda *a, **k: (path, ""))
+
+        def load():
+            editor.load_profiles()
+            settle(editor)  # Loading compacts the library in the background
+        results.append(result(f"save_{ext}", n, best_of(editor.save_profiles), "s"))
+        results.append(result(f"load_{ext}", n, best_of(load), "s"))
+    return results
+
+
+def bench_dict(n):
+    profile = make_profile(n)
+    data = profile.to_dict()
+    return [
+        result("to_dict", n, best_of(profile.to_dict), "s"),
+        result("from_dict", n, best_of(lambda: MacroProfile.from_dict(data)), "s"),
+    ]
+
+
+def bench_playback(n):
+    backend = FakeBackend()
+    runtime = MacroRuntime(backend)
+    reports = []
+    runtime.timing_report.connect(lambda name, report: reports.append(report))
+    runtime.start()
+    profile = make_profile(n, wait_ms=PLAYBACK_SPAN_S * 1000 / n)
+    profile.compiled(backend)
+    runtime.trigger(profile)
+    deadline = time.perf_counter() + PLAYBACK_SPAN_S * 5
+    while not reports and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    runtime.shutdown()
+    if not reports:
+        raise RuntimeError("Playback did not finish")
+    report = reports[0]
+    return [
+        result("playback_lateness_mean", n, report.mean_ms, "ms"),
+        result("playback_lateness_p99", n, report.p99_ms, "ms"),
+        result("playback_lateness_max", n, report.max_ms, "ms", gate=False),
+    ]
+
+
+def run_suite(sizes):
+    app = QApplication.instance() or QApplication([])
+    QMessageBox.information = staticmethod(lambda *a, **k: None)
+    QMessageBox.critical = staticmethod(lambda *a, **k: print("Error:", a[2], file=sys.stderr))
+    workdir = tempfile.mkdtemp(prefix="kzmacro-bench-")
+    backend = FakeBackend()
+    results = []
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            editor = macro.MacroEditor(backend, library_dir=os.path.join(workdir, "library"))
+            editor.profile_model.append(MacroProfile("Other"))
+            editor.show()
+            bench_record(editor, backend, 1000)  # Warm-up, so size order doesn't matter
+            settle(editor)
+        for n in sizes:
+            print(f"{n} steps...", file=sys.stderr)
+            with contextlib.redirect_stdout(io.StringIO()):
+                results += bench_record(editor, backend, n)
+                settle(editor)
+                results += bench_timeline(editor, app, n)
+                results += bench_dict(n)
+                results += bench_playback(n)
+                results += bench_persist(editor, n, workdir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            editor.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+# -------------------------------------------------------
+#               BASELINE COMPARISON
+# -------------------------------------------------------
+def compare(results, baseline, threshold):
+    """Annotate results with their change against baseline; return regressions."""
+    previous = {(r["name"], r["steps"]): r["value"] for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        base = previous.get((r["name"], r["steps"]))
+        if not base:
+            continue
+        worse_by = (r["value"] - base) if r["better"] == "lower" else (base - r["value"])
+        r["baseline"] = base
+        r["change"] = worse_by / base
+        if r["gate"] and r["change"] > threshold and worse_by > MIN_DELTA.get(r["unit"], 0):
+            regressions.append(r)
+    return regressions
+
+
+def print_table(results):
+    print(f"{'benchmark':<24} {'steps':>8} {'value':>14} {'unit':<9} {'vs baseline':>11}")
+    for r in results:
+        change = f"{r['change']:+.1%} worse" if r.get("change", 0) > 0 else (
+            f"{-r['change']:.1%} better" if "change" in r else "")
+        print(f"{r['name']:<24} {r['steps']:>8} {r['value']:>14.6g} {r['unit']:<9} {change:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Relative slowdown that counts as a regression (default 0.25)")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes)
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    print_table(results)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+        for r in regressions:
+            print(f"  {r['name']} @ {r['steps']}: {r['baseline']:.6g} -> {r['value']:.6g} {r['unit']}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
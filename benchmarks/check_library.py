@@ -0,0 +1,144 @@
+"""Consistency checks for the profile library: edits must survive compaction.
+
+Run from the repository root:
+
+    python benchmarks/check_library.py
+
+Each scenario edits a library the way the editor does (change the profile,
+journal the edit, compact now and then) and reopens it from disk. The
+script exits with status 1 if anything was lost.
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kzmacro.profile import MacroProfile  # noqa: E402
+from kzmacro.storage import MAX_LOADED_PROFILES, ProfileLibrary  # noqa: E402
+
+failures = []
+
+
+def check(ok, message):
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+def settle(library):
+    while library.is_compacting():
+        time.sleep(0.001)
+
+
+def add_profile(library, profiles, name):
+    profiles.append(MacroProfile(name))
+    library.append("add_profile", name=name)
+
+
+def add_block(library, profiles, index, text, wait_ms):
+    profiles[index].add_block(text, wait_ms)
+    library.append("add_blocks", profile=index, blocks=[[text, round(wait_ms * 1000)]])
+
+
+def reopen(directory):
+    library = ProfileLibrary(directory)
+    profiles, _ = library.open(read_only=True)
+    return [list(profile.blocks) for profile in profiles]
+
+
+# -------------------------------------------------------
+#               SCENARIOS
+# -------------------------------------------------------
+def edit_between_compactions(directory):
+    library = ProfileLibrary(directory)
+    profiles, _ = library.open()
+    add_profile(library, profiles, "A")
+    library.compact(profiles)
+    settle(library)
+    add_block(library, profiles, 0, "Key a", 10)
+    library.compact(profiles)
+    settle(library)
+    library.close()
+    check(reopen(directory) == [[("Key a", 10.0)]], "edit made between two compactions survives a reopen")
+
+
+def edit_then_evict(directory):
+    # The first edit after a compaction must keep the profile from being
+    # dropped as "safely on disk" before the next compaction writes it
+    library = ProfileLibrary(directory)
+    profiles, _ = library.open()
+    count = MAX_LOADED_PROFILES + 8
+    for i in range(count):
+        add_profile(library, profiles, f"P{i}")
+        if i:
+            add_block(library, profiles, i, "Key a", 10)
+    library.compact(profiles)
+    settle(library)
+    add_block(library, profiles, 0, "Key b", 20)
+    for profile in profiles:
+        library.touch(profile)
+    library.compact(profiles)
+    settle(library)
+    library.close()
+    blocks = reopen(directory)
+    check(blocks[0] == [("Key b", 20.0)], "edited profile is not evicted before it is compacted")
+
+
+def lru_cap_after_edits(directory):
+    library = ProfileLibrary(directory)
+    profiles, _ = library.open()
+    count = MAX_LOADED_PROFILES * 2
+    for i in range(count):
+        add_profile(library, profiles, f"P{i}")
+    for round_ in range(3):
+        for i in range(count):
+            add_block(library, profiles, i, f"Key {round_}", 10)
+        library.compact(profiles)
+        settle(library)
+    for profile in profiles:
+        library.touch(profile)
+    check(len(library.loaded) <= MAX_LOADED_PROFILES,
+          f"at most {MAX_LOADED_PROFILES} profiles stay decoded after repeated edits ({len(library.loaded)})")
+    library.close()
+    check(all(len(blocks) == 3 for blocks in reopen(directory)), "every edit round survives a reopen")
+
+
+def edit_after_failed_replace(directory):
+    # Loading a file replaces every profile; if the compaction after it never
+    # writes its index, edits made since must still land on the loaded profiles
+    library = ProfileLibrary(directory)
+    profiles, _ = library.open()
+    add_profile(library, profiles, "A")
+    library.compact(profiles)
+    settle(library)
+    library._write = lambda generation, plan: None  # Crashes before the index
+    profiles = [MacroProfile("X")]
+    library.replace_all(profiles)
+    add_block(library, profiles, 0, "Key x", 10)
+    library.wait()
+    library.close()
+    reopened = ProfileLibrary(directory)
+    names = [profile.name for profile in reopened.open(read_only=True)[0]]
+    check(names == ["X"] and reopen(directory) == [[("Key x", 10.0)]],
+          "edit after loading a file survives a compaction that never finished")
+
+
+def main():
+    for scenario in (edit_between_compactions, edit_then_evict, lru_cap_after_edits,
+                     edit_after_failed_replace):
+        directory = tempfile.mkdtemp(prefix="kzmacro-check-")
+        try:
+            scenario(directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    if failures:
+        print(f"\n{len(failures)} check(s) failed")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
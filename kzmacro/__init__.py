@@ -0,0 +1,6 @@
+"""KzMacro engine: profiles, storage, compilation, playback and hotkeys.
+
+Nothing in here imports Qt; macro.py builds the editor on top of it.
+Import the submodules directly, e.g. ``from kzmacro.runtime import
+MacroRuntime``, so tools that only convert files don't load input hooks.
+"""
@@ -0,0 +1,64 @@
+import sys
+import argparse
+
+from .runtime import STOP_HOTKEY
+from .storage import LIBRARY_DIR, convert_library
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m kzmacro", description="Headless KzMacro tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    daemon = commands.add_parser("run-daemon", help="Play library profiles on hotkeys and socket commands")
+    daemon.add_argument("--library", default=LIBRARY_DIR, help="Profile library directory")
+    daemon.add_argument("--socket", help="Unix socket path for trigger/stop commands")
+    daemon.add_argument("--no-hotkeys", action="store_true", help="Only accept socket commands")
+    daemon.add_argument("--metrics", metavar="PATH",
+                        help="Export latency histograms here: Prometheus text for .prom, else JSON lines")
+    daemon.add_argument("--metrics-interval", type=float, metavar="SECONDS",
+                        help="Seconds between metrics exports (default 15)")
+    daemon.add_argument("--stop-key", default=STOP_HOTKEY, metavar="KEY",
+                        help=f'Key that stops all playback, e.g. Key.pause (default {STOP_HOTKEY}, "none" for none)')
+
+    trigger = commands.add_parser("trigger", help="Ask a running daemon to play a profile")
+    trigger.add_argument("name")
+    trigger.add_argument("--socket")
+
+    stop = commands.add_parser("stop", help="Ask a running daemon to stop all playback")
+    stop.add_argument("--socket")
+
+    convert = commands.add_parser("convert", help="Convert between .json and .kzm files")
+    convert.add_argument("src")
+    convert.add_argument("dst")
+
+    args = parser.parse_args(argv)
+    if args.command == "convert":
+        try:
+            count = convert_library(args.src, args.dst)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return 1
+        print(f"Converted {count} profiles from {args.src} to {args.dst}")
+        return 0
+
+    # Imported here so convert works without input hooks available
+    from .daemon import DaemonClient, run_daemon
+    if args.command == "run-daemon":
+        stop_key = None if args.stop_key.lower() == "none" else args.stop_key
+        return run_daemon(args.library, args.socket, hotkeys=not args.no_hotkeys,
+                          metrics_path=args.metrics, metrics_interval=args.metrics_interval,
+                          stop_key=stop_key)
+    try:
+        with DaemonClient(args.socket) as client:
+            if args.command == "trigger":
+                print("started" if client.trigger(args.name) else "dropped")
+            else:
+                client.stop()
+    except (OSError, RuntimeError) as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
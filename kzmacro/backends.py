@@ -0,0 +1,224 @@
+import time
+import threading
+
+from .compiler import (
+    OP_KEY_PRESS, OP_KEY_RELEASE, OP_BUTTON_PRESS, OP_BUTTON_RELEASE,
+    OP_MOUSE_MOVE, OP_MOUSE_SCROLL, OP_TYPE_TEXT, OP_COUNT,
+)
+
+# -------------------------------------------------------
+#               INPUT BACKENDS
+# -------------------------------------------------------
+# A backend is the only place that talks to the OS. Keys and buttons cross
+# it as the strings blocks are recorded with ("a", "Key.shift", "<65437>",
+# "Button.left"); resolve_key()/resolve_button() turn those into whatever
+# handle the backend injects, once, at compile time.
+class InputBackend:
+    def resolve_key(self, name):
+        """Native key for a recorded key name, or None if it has none."""
+        raise NotImplementedError
+
+    def resolve_button(self, name):
+        """Native button for a name like "left", or None."""
+        raise NotImplementedError
+
+    def actions(self):
+        """Injection callables indexed by opcode.
+
+        Key/button ops take a resolved target, move takes (x, y), scroll
+        takes (dx, dy) and type text takes a str to type in one go. Called
+        once on the playback thread.
+        """
+        raise NotImplementedError
+
+    def listen(self, on_key_press=None, on_key_release=None, on_click=None,
+               on_move=None, on_scroll=None):
+        """Start global hooks and return a handle with stop().
+
+        Callbacks: on_key_press(name), on_key_release(name),
+        on_click(x, y, button_name, pressed), on_move(x, y),
+        on_scroll(x, y, dx, dy). Keyboard callbacks all arrive on one thread
+        and mouse callbacks on another.
+        """
+        raise NotImplementedError
+
+
+class PynputBackend(InputBackend):
+    def __init__(self):
+        # Imported here so the engine loads on machines without a display
+        from pynput import keyboard, mouse
+        self.keyboard = keyboard
+        self.mouse = mouse
+
+    def key_name(self, key):
+        char = getattr(key, "char", None)
+        return char if char is not None else str(key)
+
+    def resolve_key(self, name):
+        # Recorded special keys look like "Key.shift", plain keys are the char itself
+        if name.startswith("Key."):
+            name = name[4:]
+        special = getattr(self.keyboard.Key, name.lower(), None)
+        if isinstance(special, self.keyboard.Key):
+            return special
+        if len(name) == 1:
+            return name
+        # Keys without a char are recorded by virtual key code, e.g. "<65437>"
+        if name.startswith("<") and name.endswith(">") and name[1:-1].isdigit():
+            return self.keyboard.KeyCode.from_vk(int(name[1:-1]))
+        return None
+
+    def resolve_button(self, name):
+        button = getattr(self.mouse.Button, name.lower(), None)
+        return button if isinstance(button, self.mouse.Button) else None
+
+    def actions(self):
+        k = self.keyboard.Controller()
+        m = self.mouse.Controller()
+
+        def move(position):
+            m.position = position
+
+        actions = [None] * OP_COUNT
+        actions[OP_KEY_PRESS] = k.press
+        actions[OP_KEY_RELEASE] = k.release
+        actions[OP_BUTTON_PRESS] = m.press
+        actions[OP_BUTTON_RELEASE] = m.release
+        actions[OP_MOUSE_MOVE] = move
+        actions[OP_MOUSE_SCROLL] = lambda delta: m.scroll(*delta)
+        actions[OP_TYPE_TEXT] = k.type
+        return actions
+
+    def listen(self, on_key_press=None, on_key_release=None, on_click=None,
+               on_move=None, on_scroll=None):
+        key_name = self.key_name
+        key_kwargs = {}
+        if on_key_press:
+            key_kwargs["on_press"] = lambda key: on_key_press(key_name(key))
+        if on_key_release:
+            key_kwargs["on_release"] = lambda key: on_key_release(key_name(key))
+        mouse_kwargs = {"on_move": on_move, "on_scroll": on_scroll}
+        if on_click:
+            mouse_kwargs["on_click"] = lambda x, y, button, pressed: on_click(x, y, str(button), pressed)
+        return PynputListeners(
+            self.keyboard.Listener(**key_kwargs) if key_kwargs else None,
+            self.mouse.Listener(**mouse_kwargs) if any(mouse_kwargs.values()) else None,
+        )
+
+
+class PynputListeners:
+    def __init__(self, key_listener, mouse_listener):
+        self.listeners = [listener for listener in (key_listener, mouse_listener) if listener is not None]
+        for listener in self.listeners:
+            listener.start()
+
+    def stop(self):
+        for listener in self.listeners:
+            listener.stop()
+
+
+class FakeBackend(InputBackend):
+    """In-memory backend for running headless, e.g. in tests and benchmarks.
+
+    Injected events are appended to `injected` as (timestamp, opcode, target)
+    with timestamps from `clock`. The feed_* methods deliver synthetic input
+    to every listener on the calling thread, as a hook thread would.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.injected = []
+        self.position = (0, 0)
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def resolve_key(self, name):
+        if name.startswith("Key."):
+            name = name[4:]
+        if len(name) == 1 or (name.startswith("<") and name.endswith(">")):
+            return name
+        return "Key." + name.lower()
+
+    def resolve_button(self, name):
+        return "Button." + name.lower()
+
+    def actions(self):
+        clock = self.clock
+        injected = self.injected
+
+        def recorder(op):
+            def inject(target):
+                injected.append((clock(), op, target))
+            return inject
+
+        actions = [recorder(op) for op in range(OP_COUNT)]
+        record_move = actions[OP_MOUSE_MOVE]
+
+        def move(position):
+            self.position = position
+            record_move(position)
+
+        actions[OP_MOUSE_MOVE] = move
+        return actions
+
+    def clear(self):
+        del self.injected[:]
+
+    def listen(self, on_key_press=None, on_key_release=None, on_click=None,
+               on_move=None, on_scroll=None):
+        listener = FakeListener(self, on_key_press, on_key_release, on_click, on_move, on_scroll)
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+        return listener
+
+    def _remove(self, listener):
+        with self._lock:
+            self._listeners = [other for other in self._listeners if other is not listener]
+
+    def feed_key(self, name, pressed=True):
+        for listener in self._listeners:
+            callback = listener.on_key_press if pressed else listener.on_key_release
+            if callback:
+                callback(name)
+
+    def feed_click(self, button="Button.left", pressed=True, position=None):
+        x, y = position or self.position
+        for listener in self._listeners:
+            if listener.on_click:
+                listener.on_click(x, y, button, pressed)
+
+    def feed_move(self, x, y):
+        self.position = (x, y)
+        for listener in self._listeners:
+            if listener.on_move:
+                listener.on_move(x, y)
+
+    def feed_scroll(self, dx, dy):
+        x, y = self.position
+        for listener in self._listeners:
+            if listener.on_scroll:
+                listener.on_scroll(x, y, dx, dy)
+
+
+class FakeListener:
+    def __init__(self, backend, on_key_press, on_key_release, on_click, on_move, on_scroll):
+        self.backend = backend
+        self.on_key_press = on_key_press
+        self.on_key_release = on_key_release
+        self.on_click = on_click
+        self.on_move = on_move
+        self.on_scroll = on_scroll
+
+    def stop(self):
+        self.backend._remove(self)
+
+
+_default_backend = None
+
+
+def default_backend():
+    """Process-wide pynput backend, created on first use."""
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = PynputBackend()
+    return _default_backend
@@ -0,0 +1,255 @@
+from .paths import DEFAULT_MOVE_RATE_HZ, decode_move, expand_move
+
+# -------------------------------------------------------
+#               MACRO COMPILER
+# -------------------------------------------------------
+# Each release opcode is its press opcode + 1
+OP_KEY_PRESS = 0
+OP_KEY_RELEASE = 1
+OP_BUTTON_PRESS = 2
+OP_BUTTON_RELEASE = 3
+OP_MOUSE_MOVE = 4
+OP_MOUSE_SCROLL = 5
+OP_TYPE_TEXT = 6  # Target is a whole string, typed in one backend call
+OP_COUNT = 7
+
+TAP_HOLD_MS = 20  # How long a plain "Key a" / "Button.left" tap is held down
+TURBO_GAP_MS = 1  # Gap between steps in turbo mode, enough for the OS to see each event
+MIN_SPEED = 0.01
+TEXT_BATCH_MAX_WAIT_MS = 5  # Key taps at most this far apart can be typed as one batch
+TYPED_KEYS = {"Key.space": " "}  # Special keys that type a character
+
+
+def parse_loop(text):
+    """(count, length) of a "Loop <count> <length>" block, or None."""
+    try:
+        _, count, length = text.split(" ")
+        return max(int(count), 0), max(int(length), 0)
+    except ValueError:
+        return None
+
+
+def expand_loops(blocks):
+    """Yield blocks with every Loop block unrolled.
+
+    "Loop n k" plays the k blocks after it n times. Its own wait leads into
+    the first pass; the body's first wait is the gap between passes. Loops
+    do not nest.
+    """
+    i = 0
+    while i < len(blocks):
+        text, wait_ms = blocks[i]
+        loop = parse_loop(text) if text.startswith("Loop ") else None
+        if loop is None:
+            yield text, wait_ms
+            i += 1
+            continue
+        count, length = loop
+        body = blocks[i + 1:i + 1 + length]
+        for n in range(count):
+            for j, (body_text, body_wait_ms) in enumerate(body):
+                yield body_text, wait_ms if n == 0 and j == 0 else body_wait_ms
+        i += 1 + length
+
+
+def typed_char(text):
+    """The character a "Key x" tap types, or None for other blocks."""
+    if not text.startswith("Key "):
+        return None
+    name = text[4:]
+    if len(name) == 1:
+        return name if name.isprintable() else None
+    return TYPED_KEYS.get(name)
+
+
+def pair_taps(blocks):
+    """Turn a key's Down straight followed by its Up into a plain tap.
+
+    Only pairs with nothing in between and at most TEXT_BATCH_MAX_WAIT_MS of
+    hold qualify, so text batching sees recorded typing the same way as
+    legacy "Key x" taps. Longer holds and chords pass through untouched.
+    """
+    pending = None  # A "Key x Down" block waiting to see what follows
+    for text, wait_ms in blocks:
+        if pending is not None:
+            down_text, down_wait, name = pending
+            pending = None
+            if wait_ms <= TEXT_BATCH_MAX_WAIT_MS and text == f"Key {name} Up":
+                yield f"Key {name}", down_wait
+                continue
+            yield down_text, down_wait
+        if text.startswith("Key ") and text.endswith(" Down"):
+            name, edge = split_edge(text[4:])
+            if edge == "down" and typed_char(f"Key {name}") is not None:
+                pending = (text, wait_ms, name)
+                continue
+        yield text, wait_ms
+    if pending is not None:
+        yield pending[0], pending[1]
+
+
+def retime_waits(blocks, speed=1.0, min_wait_ms=0.0, max_wait_ms=0.0, coalesce_ms=0.0, turbo=False):
+    """Yield (text, wait_ms) blocks with their waits adjusted for playback.
+
+    Waits are divided by speed, then clamped to [min_wait_ms, max_wait_ms]
+    (no upper clamp when 0). Waits still shorter than coalesce_ms are
+    dropped and their time added to the next longer wait, so bursts fire
+    back to back without shortening the macro. Turbo ignores all of that
+    and spaces every step TURBO_GAP_MS apart.
+    """
+    if turbo:
+        for text, _ in blocks:
+            yield text, TURBO_GAP_MS
+        return
+    speed = max(speed, MIN_SPEED)
+    carried = 0.0
+    for text, wait_ms in blocks:
+        wait_ms = max(wait_ms / speed, min_wait_ms)
+        if max_wait_ms > 0:
+            wait_ms = min(wait_ms, max_wait_ms)
+        if wait_ms < coalesce_ms:
+            carried += wait_ms
+            wait_ms = 0.0
+        elif carried:
+            wait_ms += carried
+            carried = 0.0
+        yield text, wait_ms
+
+
+def split_edge(name):
+    """Split "a Down" into ("a", "down"); a bare name is a tap, edge ""."""
+    key, sep, edge = name.rpartition(" ")
+    if sep and key and edge.lower() in ("down", "up"):
+        return key, edge.lower()
+    return name, ""
+
+
+def resolve_block(text, backend):
+    """Return (press_op, release_op, target, is_tap) for a block, or None."""
+    if text.startswith("Key "):
+        name, edge = split_edge(text[4:])
+        key = backend.resolve_key(name)
+        if key is None:
+            return None
+        if edge == "down":
+            return OP_KEY_PRESS, None, key, False
+        if edge == "up":
+            return OP_KEY_RELEASE, None, key, False
+        return OP_KEY_PRESS, OP_KEY_RELEASE, key, True
+
+    if text.startswith("Button."):
+        name, _, edge = text[7:].partition(" ")
+        button = backend.resolve_button(name)
+        if button is None:
+            return None
+        edge = edge.strip().lower()
+        if edge == "down":
+            return OP_BUTTON_PRESS, None, button, False
+        if edge == "up":
+            return OP_BUTTON_RELEASE, None, button, False
+        return OP_BUTTON_PRESS, OP_BUTTON_RELEASE, button, True
+
+    if text.startswith("Scroll "):
+        try:
+            dx, dy = (int(v) for v in text.split(" ")[1:3])
+        except ValueError:
+            return None
+        return OP_MOUSE_SCROLL, None, (dx, dy), False
+
+    return None
+
+
+def compile_blocks(blocks, move_rate_hz=DEFAULT_MOVE_RATE_HZ, backend=None, path_speed=1.0,
+                   batch_text=False):
+    """Turn (text, wait_ms) blocks into a flat list of (opcode, target, at_ms).
+
+    at_ms is the offset from the start of the run. Taps become a press and a
+    release; the release is held for TAP_HOLD_MS or until the next step fires.
+    Move blocks are interpolated at move_rate_hz and their recorded timing
+    divided by path_speed. Key and button targets are resolved by backend,
+    the pynput one unless given. Run blocks through retime_waits() first to
+    change the waits between steps.
+
+    With batch_text, runs of two or more printable key taps no more than
+    TEXT_BATCH_MAX_WAIT_MS apart become a single OP_TYPE_TEXT step, and
+    everything after the run moves up by the waits it no longer needs.
+    Nothing is batched while a key is held down: typed text ignores
+    modifiers, so Shift or Ctrl chords play key by key.
+    """
+    if backend is None:
+        from .backends import default_backend  # backends imports the opcodes from here
+        backend = default_backend()
+    resolved = []
+    actions = {}  # Blocks repeat a lot, so each distinct text is resolved once
+
+    def resolve(text, at_ms):
+        if text in actions:
+            action = actions[text]
+        else:
+            action = actions[text] = resolve_block(text, backend)
+            if action is None:
+                print(f"Skipping unknown block: {text}")
+        if action is not None:
+            resolved.append((action, at_ms))
+
+    def flush_text(batch):
+        if len(batch) > 1:
+            text = "".join(char for _, char, _ in batch)
+            resolved.append(((OP_TYPE_TEXT, None, text, False), batch[0][2]))
+        elif batch:
+            resolve(batch[0][0], batch[0][2])
+
+    if batch_text:
+        blocks = pair_taps(blocks)
+    batch = []  # (block text, char, at_ms) of the key taps being batched
+    held = set()  # Keys pressed and not yet released, while batching
+    at_ms = 0
+    for i, (text, wait_ms) in enumerate(blocks):
+        if i > 0:
+            at_ms += wait_ms
+        if batch_text:
+            char = typed_char(text) if not held else None
+            if text.startswith("Key "):
+                name, edge = split_edge(text[4:])
+                if edge == "down":
+                    held.add(name)
+                elif edge == "up":
+                    held.discard(name)
+            if char is not None and batch and wait_ms <= TEXT_BATCH_MAX_WAIT_MS:
+                batch.append((text, char, at_ms))
+                at_ms -= wait_ms  # Typed along with the rest of the batch
+                continue
+            flush_text(batch)
+            batch = []
+            if char is not None:
+                batch.append((text, char, at_ms))
+                continue
+        if text.startswith("Move "):
+            try:
+                resolved.append((decode_move(text), at_ms))
+            except ValueError:
+                print(f"Skipping malformed move: {text[:40]}")
+            continue
+        resolve(text, at_ms)
+    flush_text(batch)
+
+    path_speed = max(path_speed, MIN_SPEED)
+    plan = []
+    for i, (action, at_ms) in enumerate(resolved):
+        next_ms = resolved[i + 1][1] if i + 1 < len(resolved) else None
+        if isinstance(action, list):
+            for offset_ms, position in expand_move(action, move_rate_hz / path_speed):
+                move_ms = at_ms + offset_ms / path_speed
+                if next_ms is not None:
+                    move_ms = min(move_ms, next_ms)
+                plan.append((OP_MOUSE_MOVE, position, move_ms))
+            continue
+
+        press_op, release_op, target, is_tap = action
+        plan.append((press_op, target, at_ms))
+        if is_tap:
+            release_ms = at_ms + TAP_HOLD_MS
+            if next_ms is not None:
+                release_ms = min(release_ms, next_ms)
+            plan.append((release_op, target, release_ms))
+    return plan
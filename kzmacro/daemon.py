@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import signal
+import socket
+import socketserver
+import tempfile
+import threading
+
+from .hotkeys import HotkeyDispatcher
+from .metrics import export_metrics
+from .runtime import STOP_HOTKEY, MacroRuntime
+from .storage import LIBRARY_DIR, ProfileLibrary
+
+# -------------------------------------------------------
+#               HEADLESS DAEMON
+# -------------------------------------------------------
+METRICS_INTERVAL_S = 15.0  # How often --metrics is rewritten
+
+# Line protocol over a Unix stream socket. A client may keep its connection
+# open and send any number of commands, each answered with one line:
+#
+#   trigger <profile name>   ok started | ok dropped | error ...
+#   stop                     ok
+#   reload                   ok <profile count>
+#   list                     ok <name>\t<name>...
+#   stats                    ok <metrics snapshot as JSON>
+#   ping                     ok
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "kzmacro.sock")
+    return os.path.join(tempfile.gettempdir(), f"kzmacro-{os.getuid()}.sock")
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            reply = self.server.macro_daemon.handle(line.decode("utf-8").strip())
+            self.wfile.write(reply.encode("utf-8") + b"\n")
+
+
+class MacroDaemon:
+    """Plays library profiles on hotkeys and socket commands, without Qt."""
+
+    def __init__(self, library_dir=LIBRARY_DIR, socket_path=None, hotkeys=True, backend=None,
+                 metrics_path=None, metrics_interval=METRICS_INTERVAL_S, stop_key=STOP_HOTKEY):
+        self.library_dir = library_dir
+        self.socket_path = socket_path or default_socket_path()
+        self.metrics_path = metrics_path  # .prom or JSON lines file, rewritten periodically
+        self.metrics_interval = metrics_interval
+        self.runtime = MacroRuntime(backend)
+        self.dispatcher = HotkeyDispatcher(self.runtime, stop_key=stop_key) if hotkeys else None
+        self.library = None
+        self.profiles = []
+        self.by_name = {}
+        self._touch_lock = threading.Lock()  # Hook and client threads share the LRU
+        self._server = None
+        self._stopped = threading.Event()
+
+    def load(self):
+        # Read only: the editor may own the library and its journal
+        library = ProfileLibrary(self.library_dir)
+        profiles, _ = library.open(read_only=True)
+        by_name = {}
+        for profile in profiles:
+            by_name.setdefault(profile.name, profile)
+        self.library, self.profiles, self.by_name = library, profiles, by_name
+        if self.dispatcher:
+            for button, owners in self.dispatcher.rebuild(profiles).items():
+                names = ", ".join(profile.name for profile in owners)
+                print(f"Hotkey {button} is assigned to {len(owners)} profiles ({names}), {owners[0].name} gets it")
+        return len(profiles)
+
+    def handle(self, line):
+        command, _, arg = line.partition(" ")
+        try:
+            if command == "trigger":
+                triggered_at = time.perf_counter()
+                profile = self.by_name.get(arg)
+                if profile is None:
+                    return f"error unknown profile {arg!r}"
+                started = self.runtime.trigger(profile, triggered_at)
+                self.touch(profile)
+                return "ok started" if started else "ok dropped"
+            if command == "stop":
+                self.runtime.stop()
+                return "ok"
+            if command == "reload":
+                return f"ok {self.load()}"
+            if command == "list":
+                return "ok " + "\t".join(self.by_name)
+            if command == "stats":
+                return "ok " + json.dumps(self.runtime.metrics.snapshot(), separators=(",", ":"))
+            if command == "ping":
+                return "ok"
+            return f"error unknown command {command!r}"
+        except Exception as e:
+            return f"error {e}"
+
+    def touch(self, profile):
+        with self._touch_lock:
+            self.library.touch(profile)
+
+    def on_triggered(self, profile, started):
+        self.touch(profile)
+
+    def _claim_socket(self):
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError:
+            os.unlink(self.socket_path)  # Left behind by a daemon that died
+        else:
+            raise RuntimeError(f"Another daemon is listening on {self.socket_path}")
+        finally:
+            probe.close()
+
+    def start(self):
+        self.load()
+        self._claim_socket()
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, CommandHandler)
+        self._server.daemon_threads = True
+        self._server.macro_daemon = self
+        os.chmod(self.socket_path, 0o600)
+        self.runtime.start()
+        if self.dispatcher:
+            self.dispatcher.triggered.connect(self.on_triggered)
+            self.dispatcher.start()
+        threading.Thread(target=self._server.serve_forever, name="daemon-socket", daemon=True).start()
+        if self.metrics_path:
+            threading.Thread(target=self._export_metrics, name="daemon-metrics", daemon=True).start()
+        print(f"KzMacro daemon: {len(self.profiles)} profiles, listening on {self.socket_path}")
+
+    def _export_metrics(self):
+        while not self._stopped.wait(self.metrics_interval):
+            self.export_metrics()
+
+    def export_metrics(self):
+        try:
+            export_metrics(self.metrics_path, self.runtime.metrics.snapshot())
+        except OSError as e:
+            print(f"Could not export metrics to {self.metrics_path}: {e}")
+
+    def stop(self):
+        self._stopped.set()
+
+    def wait(self):
+        self._stopped.wait()
+        self._server.shutdown()
+        self._server.server_close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+        if self.dispatcher:
+            self.dispatcher.stop()
+        self.runtime.shutdown()
+        if self.metrics_path:
+            self.export_metrics()
+
+
+def run_daemon(library_dir=LIBRARY_DIR, socket_path=None, hotkeys=True,
+               metrics_path=None, metrics_interval=METRICS_INTERVAL_S, stop_key=STOP_HOTKEY):
+    if not hasattr(socket, "AF_UNIX"):
+        print("The daemon needs Unix domain sockets, which this platform lacks")
+        return 1
+    try:
+        # Creating the input backend already fails without a display
+        daemon = MacroDaemon(library_dir, socket_path, hotkeys, metrics_path=metrics_path,
+                             metrics_interval=metrics_interval or METRICS_INTERVAL_S, stop_key=stop_key)
+        daemon.start()
+    except Exception as e:
+        print(f"Could not start the daemon: {e}")
+        return 1
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: daemon.stop())
+    daemon.wait()
+    return 0
+
+
+class DaemonClient:
+    """Keeps one connection open so each command is a single round trip."""
+
+    def __init__(self, socket_path=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path or default_socket_path())
+        self.reader = self.sock.makefile("rb")
+
+    def command(self, line):
+        self.sock.sendall(line.encode("utf-8") + b"\n")
+        reply = self.reader.readline().decode("utf-8").rstrip("\n")
+        if not reply:
+            raise ConnectionError("Daemon closed the connection")
+        status, _, message = reply.partition(" ")
+        if status != "ok":
+            raise RuntimeError(message)
+        return message
+
+    def trigger(self, name):
+        return self.command(f"trigger {name}") == "started"
+
+    def stop(self):
+        self.command("stop")
+
+    def stats(self):
+        return json.loads(self.command("stats"))
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
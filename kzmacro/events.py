@@ -0,0 +1,23 @@
+# -------------------------------------------------------
+#               EVENTS
+# -------------------------------------------------------
+class Signal:
+    """Minimal stand-in for pyqtSignal so the engine runs without Qt.
+
+    Handlers run on the emitting thread; the GUI connects them to real Qt
+    signals to get queued delivery on its own thread.
+    """
+    __slots__ = ("_handlers",)
+
+    def __init__(self):
+        self._handlers = []
+
+    def connect(self, handler):
+        self._handlers.append(handler)
+
+    def disconnect(self, handler):
+        self._handlers.remove(handler)
+
+    def emit(self, *args):
+        for handler in self._handlers:
+            handler(*args)
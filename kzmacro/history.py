@@ -0,0 +1,78 @@
+# -------------------------------------------------------
+#               EDIT HISTORY
+# -------------------------------------------------------
+# Undo and redo store the edit that reverses a change rather than a copy of
+# the blocks:
+#   (EDIT_INSERT, index, steps)       put steps back, steps being
+#                                     (text, wait_ms, step_id) tuples
+#   (EDIT_DELETE, first_id, count)    remove count steps from first_id on
+#   (EDIT_SWAP, blocks)               make this BlockList the profile's blocks
+# Undoing one edit gives the edit that redoes it, and the other way round.
+# Replacing all blocks (optimize, clear) swaps in a new BlockList and keeps
+# the old one, so the two share nothing and neither is ever copied.
+EDIT_INSERT = "insert"
+EDIT_DELETE = "delete"
+EDIT_SWAP = "swap"
+UNDO_LIMIT = 200  # Undo steps kept per profile
+
+
+class EditHistory:
+    """Undo and redo stacks for one profile.
+
+    Each stack entry is a list of edits undone together, last one first.
+    Between begin_group() and end_group() every change lands in the same
+    entry, so a whole recording take is one undo step.
+    """
+
+    def __init__(self, blocks):
+        self.blocks = blocks  # The BlockList the step ids in the stacks refer to
+        self.undo_stack = []
+        self.redo_stack = []
+        self.grouping = False
+        self.open_entry = None  # Entry that changes are being added to
+
+    def push(self, edit, joined=False):
+        """Record the edit that undoes a change just made.
+
+        joined puts it in the same entry as the edit pushed just before, for
+        a change made of several edits.
+        """
+        if joined and self.undo_stack:
+            self.undo_stack[-1].append(edit)
+            return
+        self.redo_stack.clear()
+        entry = self.open_entry
+        if entry is None or not self.undo_stack or self.undo_stack[-1] is not entry:
+            entry = []
+            self.undo_stack.append(entry)
+            if len(self.undo_stack) > UNDO_LIMIT:
+                del self.undo_stack[0]
+            self.open_entry = entry if self.grouping else None
+        if entry and entry[-1][0] == EDIT_DELETE == edit[0] and entry[-1][1] + entry[-1][2] == edit[1]:
+            # Appends right after each other, e.g. every drain while recording
+            entry[-1] = (EDIT_DELETE, entry[-1][1], entry[-1][2] + edit[2])
+        else:
+            entry.append(edit)
+
+    def begin_group(self):
+        self.grouping = True
+        self.open_entry = None
+
+    def end_group(self):
+        self.grouping = False
+        self.open_entry = None
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def take_undo(self):
+        entry = self.undo_stack.pop()
+        if entry is self.open_entry:
+            self.open_entry = None
+        return entry
+
+    def take_redo(self):
+        return self.redo_stack.pop()
@@ -0,0 +1,109 @@
+import time
+
+from .events import Signal
+from .runtime import STOP_HOTKEY
+
+# -------------------------------------------------------
+#               HOTKEY DISPATCHER
+# -------------------------------------------------------
+def hotkey_index(profiles):
+    """Assigned key/button string -> every profile using it, in list order."""
+    index = {}
+    for profile in profiles:
+        if profile.assigned_button:
+            index.setdefault(profile.assigned_button, []).append(profile)
+    return index
+
+
+def hotkey_conflicts(index):
+    return {button: owners for button, owners in index.items() if len(owners) > 1}
+
+
+class HotkeyDispatcher:
+    """Keeps every profile's hotkey armed behind one pair of OS hooks.
+
+    Each input event costs a single dict lookup. rebuild() swaps in a new
+    index without touching the running listeners. When profiles share a
+    hotkey the first one in the list gets it. The stop key aborts all
+    playback, unless playback pressed it itself. Signals fire on the hook
+    threads.
+    """
+
+    def __init__(self, runtime, backend=None, stop_key=STOP_HOTKEY):
+        self.triggered = Signal()  # (MacroProfile, playback started)
+        self.captured = Signal()   # Next key/button after capture_next()
+        self.runtime = runtime
+        self.backend = backend or runtime.backend  # Where the hooks come from
+        self.bindings = {}  # Normalized key/button string -> MacroProfile
+        self.conflicts = {}  # Key/button string -> profiles sharing it
+        self.capturing = False
+        self.listener = None
+        self.set_stop_key(stop_key)
+
+    def start(self):
+        metrics = self.runtime.metrics
+        self.listener = self.backend.listen(
+            on_key_press=metrics.timed("hotkey_key", self.dispatch),
+            on_key_release=metrics.timed("hotkey_key", self.dispatch_release),
+            on_click=metrics.timed("hotkey_mouse", self.on_click),
+        )
+
+    def rebuild(self, profiles):
+        """Swap in the bindings for profiles; returns the hotkey conflicts."""
+        index = hotkey_index(profiles)
+        bindings = {button: owners[0] for button, owners in index.items()}
+        # Compile up front so a trigger finds its first action already resolved.
+        # Profiles still lazily mapped from a library stay that way until played.
+        for profile in bindings.values():
+            if profile.is_loaded():
+                profile.compiled(self.runtime.backend)
+        self.bindings = bindings
+        self.conflicts = hotkey_conflicts(index)
+        return self.conflicts
+
+    def set_stop_key(self, name):
+        """Stop all playback on name, e.g. "Key.esc"; None for no stop key."""
+        backend = self.runtime.backend
+        if name is None:
+            target = None
+        elif name.startswith("Button."):
+            target = backend.resolve_button(name[len("Button."):])
+        else:
+            target = backend.resolve_key(name)
+        self.runtime.echo_target = target
+        self.stop_key = name
+
+    def capture_next(self):
+        # Swallow the next key/button instead of dispatching it
+        self.capturing = True
+
+    def dispatch(self, button_str):
+        if button_str == self.stop_key and not self.runtime.is_echo():
+            # Stopping the runtime is thread-safe
+            self.runtime.stop()
+        if self.capturing:
+            self.capturing = False
+            self.captured.emit(button_str)
+            return
+        profile = self.bindings.get(button_str)
+        if profile is not None:
+            # Start playback right here on the hook thread; the signal is
+            # only for the GUI to show what happened
+            started = self.runtime.trigger(profile, time.perf_counter())
+            self.triggered.emit(profile, started)
+
+    def dispatch_release(self, button_str):
+        # Only "repeat while held" profiles care when their hotkey goes up
+        profile = self.bindings.get(button_str)
+        if profile is not None:
+            self.runtime.release(profile)
+
+    def on_click(self, x, y, button, pressed):
+        if pressed:
+            self.dispatch(str(button))
+        else:
+            self.dispatch_release(str(button))
+
+    def stop(self):
+        if self.listener:
+            self.listener.stop()
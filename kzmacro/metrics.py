@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import bisect
+import threading
+
+# -------------------------------------------------------
+#               METRICS
+# -------------------------------------------------------
+# Bucket upper bounds in microseconds, 1-2.5-5 per decade from 10 µs to 10 s.
+# Anything slower lands in a final overflow bucket.
+BUCKET_BOUNDS_US = (
+    10, 25, 50, 100, 250, 500,
+    1_000, 2_500, 5_000, 10_000, 25_000, 50_000,
+    100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000,
+)
+
+# Per-profile histograms, in display order
+PROFILE_METRICS = {
+    "trigger_latency": "Trigger to first injection",
+    "step_lateness": "Step lateness (actual - scheduled)",
+    "injection": "Injection call duration",
+}
+
+
+class Histogram:
+    """Fixed buckets, so recording is one bisect and never allocates.
+
+    Each histogram has a single writer thread; readers take a snapshot()
+    that may be one sample behind, which is fine for a dashboard.
+    """
+    __slots__ = ("counts", "sum_us", "max_us")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_US) + 1)
+        self.sum_us = 0.0
+        self.max_us = 0.0
+
+    def record(self, seconds):
+        us = seconds * 1e6
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_US, us)] += 1
+        self.sum_us += us
+        if us > self.max_us:
+            self.max_us = us
+
+    def snapshot(self):
+        counts = list(self.counts)
+        return {"count": sum(counts), "sum_us": self.sum_us, "max_us": self.max_us, "buckets": counts}
+
+
+def quantile_us(snapshot, q):
+    """Upper bound of the bucket holding quantile q, capped at the max seen."""
+    count = snapshot["count"]
+    if not count:
+        return 0.0
+    rank = q * count
+    seen = 0
+    for i, n in enumerate(snapshot["buckets"]):
+        seen += n
+        if seen >= rank and n:
+            if i < len(BUCKET_BOUNDS_US):
+                return min(BUCKET_BOUNDS_US[i], snapshot["max_us"])
+            break
+    return snapshot["max_us"]
+
+
+def mean_us(snapshot):
+    return snapshot["sum_us"] / snapshot["count"] if snapshot["count"] else 0.0
+
+
+class ProfileMetrics:
+    __slots__ = tuple(PROFILE_METRICS)
+
+    def __init__(self):
+        for name in PROFILE_METRICS:
+            setattr(self, name, Histogram())
+
+    def snapshot(self):
+        return {name: getattr(self, name).snapshot() for name in PROFILE_METRICS}
+
+
+class Metrics:
+    """Latency histograms per profile and per input hook.
+
+    Profiles are keyed by name so exported series stay stable across
+    restarts. The runtime thread writes the profile histograms; each hook
+    writes its own listener histogram.
+    """
+
+    def __init__(self):
+        self.profiles = {}   # Profile name -> ProfileMetrics
+        self.listeners = {}  # Hook name -> Histogram of callback durations
+        self.started_at = time.time()
+        self._lock = threading.Lock()  # Only taken to add an entry
+
+    def profile(self, name):
+        metrics = self.profiles.get(name)
+        if metrics is None:
+            with self._lock:
+                metrics = self.profiles.setdefault(name, ProfileMetrics())
+        return metrics
+
+    def listener(self, name):
+        histogram = self.listeners.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.listeners.setdefault(name, Histogram())
+        return histogram
+
+    def timed(self, name, callback):
+        """Wrap a hook callback so its duration lands in listener(name)."""
+        histogram = self.listener(name)
+        clock = time.perf_counter
+
+        def timed_callback(*args):
+            start = clock()
+            try:
+                return callback(*args)
+            finally:
+                histogram.record(clock() - start)
+        return timed_callback
+
+    def reset(self):
+        # Swap in fresh histograms; writers holding an old one finish into it
+        with self._lock:
+            for metrics in self.profiles.values():
+                for name in PROFILE_METRICS:
+                    setattr(metrics, name, Histogram())
+            for name in self.listeners:
+                self.listeners[name] = Histogram()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            profiles = list(self.profiles.items())
+            listeners = list(self.listeners.items())
+        return {
+            "timestamp": time.time(),
+            "since": self.started_at,
+            "profiles": {name: metrics.snapshot() for name, metrics in profiles},
+            "listeners": {name: histogram.snapshot() for name, histogram in listeners},
+        }
+
+
+# -------------------------------------------------------
+#               EXPORT
+# -------------------------------------------------------
+def append_jsonl(path, snapshot):
+    """Append one snapshot as a JSON line; counters are cumulative."""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(snapshot, separators=(",", ":")) + "\n")
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prometheus_histogram(lines, metric, labels, snapshot):
+    cumulative = 0
+    for bound_us, count in zip(BUCKET_BOUNDS_US, snapshot["buckets"]):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{{labels},le="{bound_us / 1e6:g}"}} {cumulative}')
+    lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {snapshot["count"]}')
+    lines.append(f"{metric}_sum{{{labels}}} {snapshot['sum_us'] / 1e6:.9g}")
+    lines.append(f"{metric}_count{{{labels}}} {snapshot['count']}")
+
+
+def to_prometheus(snapshot):
+    """Render a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, description in PROFILE_METRICS.items():
+        metric = f"kzmacro_{name}_seconds"
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} histogram")
+        for profile, histograms in snapshot["profiles"].items():
+            _prometheus_histogram(lines, metric, f'profile="{_label(profile)}"', histograms[name])
+    metric = "kzmacro_listener_callback_seconds"
+    lines.append(f"# HELP {metric} Time spent inside input hook callbacks")
+    lines.append(f"# TYPE {metric} histogram")
+    for listener, histogram in snapshot["listeners"].items():
+        _prometheus_histogram(lines, metric, f'listener="{_label(listener)}"', histogram)
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path, snapshot):
+    # Collectors read the file whenever they like, so never expose a partial one
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(to_prometheus(snapshot))
+    os.replace(tmp_path, path)
+
+
+def export_metrics(path, snapshot):
+    """Write snapshot to path: Prometheus text for .prom, else a JSON line."""
+    if path.lower().endswith(".prom"):
+        write_prometheus(path, snapshot)
+    else:
+        append_jsonl(path, snapshot)
@@ -0,0 +1,206 @@
+import bisect
+
+from .compiler import TAP_HOLD_MS, expand_loops, split_edge
+from .paths import decode_move, encode_move
+
+# -------------------------------------------------------
+#               MACRO OPTIMIZER
+# -------------------------------------------------------
+# Rewrites a block list into a shorter one that plays the same way, up to
+# the tolerances below. Always starts from the unrolled form, so loops from
+# an earlier run are folded again from scratch.
+CLICK_MAX_HOLD_MS = TAP_HOLD_MS  # A Down/Up pair held at most this long becomes a plain tap
+MERGE_MAX_WAIT_MS = 1      # Scrolls this close together are summed into one
+WAIT_TOLERANCE_MS = 2      # Most a folded loop may shift any step it replaces
+MAX_LOOP_BODY = 64         # Longest repeated sequence looked for
+
+
+def merge_taps(blocks, max_hold_ms=CLICK_MAX_HOLD_MS):
+    """Down straight followed by its own Up becomes a tap.
+
+    A tap is held for TAP_HOLD_MS, so only pairs held no longer than that
+    qualify; real holds stay as recorded. The hold is added to the next
+    wait to keep later steps in place.
+    """
+    out = []
+    carried = 0.0
+    i = 0
+    while i < len(blocks):
+        text, wait_ms = blocks[i]
+        wait_ms += carried
+        carried = 0.0
+        if text.endswith(" Down") and i + 1 < len(blocks):
+            name, edge = split_edge(text)
+            next_text, hold_ms = blocks[i + 1]
+            if edge == "down" and next_text == f"{name} Up" and hold_ms <= max_hold_ms:
+                out.append((name, wait_ms))
+                carried = hold_ms
+                i += 2
+                continue
+        out.append((text, wait_ms))
+        i += 1
+    return out
+
+
+def merge_scrolls(blocks, max_wait_ms=MERGE_MAX_WAIT_MS):
+    """Scrolls with (nearly) no wait between them become one."""
+    out = []
+    carried = 0.0  # Waits of merged scrolls, owed to the next block
+    for text, wait_ms in blocks:
+        if text.startswith("Scroll ") and out and out[-1][0].startswith("Scroll ") and wait_ms <= max_wait_ms:
+            try:
+                dx1, dy1 = (int(v) for v in out[-1][0].split(" ")[1:3])
+                dx2, dy2 = (int(v) for v in text.split(" ")[1:3])
+            except ValueError:
+                pass
+            else:
+                out[-1] = (f"Scroll {dx1 + dx2} {dy1 + dy2}", out[-1][1])
+                carried += wait_ms
+                continue
+        out.append((text, wait_ms + carried))
+        carried = 0.0
+    return out
+
+
+def merge_moves(blocks):
+    """Consecutive Move strokes become one path that waits out the gaps."""
+    out = []
+    path = None     # Points of the Move at out[-1], in ms from its start
+    merged = False  # Whether path needs encoding again
+    since = 0.0     # From the start of path to the block being looked at
+    for text, wait_ms in blocks:
+        if path is not None:
+            since += wait_ms
+            points = _decode(text) if text.startswith("Move ") else None
+            if points is not None and since >= path[-1][0]:
+                start = round(since)
+                if path[-1][1:] != points[0][1:]:
+                    # Stay put until the next stroke starts, then jump to it
+                    path.append((start, *path[-1][1:]))
+                path.extend((start + t, x, y) for t, x, y in points)
+                merged = True
+                continue
+            if merged:
+                out[-1] = (encode_path(path), out[-1][1])
+            path = None
+            wait_ms = since  # Now counted from the start of the merged stroke
+        out.append((text, wait_ms))
+        if text.startswith("Move "):
+            path, merged, since = _decode(text), False, 0.0
+    if path is not None and merged:
+        out[-1] = (encode_path(path), out[-1][1])
+    return out
+
+
+def _decode(text):
+    try:
+        return decode_move(text)
+    except ValueError:
+        return None
+
+
+def encode_path(points):
+    return encode_move([(t * 1_000_000, x, y) for t, x, y in points])
+
+
+def _pass_drift(waits, body, start, length, gap, drift, tolerance_ms):
+    """Drift after replaying the body over the pass at start, or None if too far.
+
+    Every pass replays the body's waits, with gap in front, so the
+    differences to the recorded waits add up from pass to pass. drift is
+    that running total so far, and it has to stay within tolerance at
+    every step, not just per wait.
+    """
+    for j in range(length):
+        drift += waits[start + j] - (gap if j == 0 else waits[body + j])
+        if abs(drift) > tolerance_ms:
+            return None
+    return drift
+
+
+def fold_repeats(blocks, tolerance_ms=WAIT_TOLERANCE_MS, max_body=MAX_LOOP_BODY):
+    """Fold back-to-back repeats of a sequence into a Loop block.
+
+    At each position, picks the body length that removes the most blocks.
+    No step moves more than tolerance_ms from its recorded time: a loop ends
+    where its running drift would go past that, and the block after it
+    makes up the drift.
+    Only lengths where the same text shows up again are tried, found through
+    a per-text index of positions, so varied recordings stay cheap.
+    """
+    texts = [text for text, _ in blocks]
+    waits = [wait_ms for _, wait_ms in blocks]
+    positions = {}
+    for i, text in enumerate(texts):
+        positions.setdefault(text, []).append(i)
+
+    out = []
+    n = len(blocks)
+    owed = 0.0  # Recorded minus replayed time of the loops so far
+    i = 0
+    while i < n:
+        best = None  # (blocks saved, body length, count, drift)
+        same = positions[texts[i]]
+        k = bisect.bisect_right(same, i)
+        while k < len(same) and same[k] - i <= max_body and 2 * (same[k] - i) <= n - i:
+            length = same[k] - i
+            k += 1
+            body = texts[i:i + length]
+            gap = waits[i + length]
+            count = 1
+            drift = 0.0
+            while True:
+                start = i + count * length
+                if start + length > n or texts[start:start + length] != body:
+                    break
+                next_drift = _pass_drift(waits, i, start, length, gap, drift, tolerance_ms)
+                if next_drift is None:
+                    break
+                drift = next_drift
+                count += 1
+            saved = length * count - (length + 1)
+            if count > 1 and saved > 0 and (best is None or saved > best[0]):
+                best = (saved, length, count, drift)
+        # Whatever follows a loop makes up its drift, so drift never adds up
+        # from one loop to the next
+        wait_ms = waits[i] + owed
+        owed = min(wait_ms, 0.0)
+        wait_ms -= owed
+        if best is None:
+            out.append((texts[i], wait_ms))
+            i += 1
+            continue
+        _, length, count, drift = best
+        owed += drift
+        out.append((f"Loop {count} {length}", wait_ms))
+        out.append((texts[i], waits[i + length]))
+        out.extend(blocks[i + 1:i + length])
+        i += length * count
+    return out
+
+
+def optimize_blocks(blocks, fold_loops=True):
+    """Return a shorter (text, wait_ms) list that plays like blocks."""
+    steps = list(expand_loops(blocks))
+    steps = merge_taps(steps)
+    steps = merge_scrolls(steps)
+    steps = merge_moves(steps)
+    if fold_loops:
+        steps = fold_repeats(steps)
+    return steps
+
+
+def estimate_runtime_ms(blocks):
+    """Time from the first step to the last, loops unrolled."""
+    total = 0.0
+    last_move_ms = 0
+    for i, (text, wait_ms) in enumerate(expand_loops(blocks)):
+        if i > 0:
+            total += wait_ms
+        last_move_ms = 0
+        if text.startswith("Move "):
+            try:
+                last_move_ms = decode_move(text)[-1][0]
+            except ValueError:
+                pass
+    return total + last_move_ms
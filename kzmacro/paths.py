@@ -0,0 +1,89 @@
+import math
+
+# -------------------------------------------------------
+#               MOUSE PATHS
+# -------------------------------------------------------
+# Recorded movement is stored as "Move x0,y0 dx,dy,dt dx,dy,dt ...": an
+# absolute start point followed by deltas in pixels and milliseconds.
+MOVE_MIN_INTERVAL_NS = 8_000_000  # Raw move samples closer than this are dropped
+MOVE_EPSILON_PX = 2.0             # Max distance the simplified path may stray
+STROKE_GAP_NS = 100_000_000       # A pause this long ends a movement stroke
+DEFAULT_MOVE_RATE_HZ = 100        # Playback interpolation rate
+
+
+def simplify_path(points, epsilon=MOVE_EPSILON_PX):
+    """Ramer-Douglas-Peucker over (timestamp, x, y) points."""
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        _, x1, y1 = points[first]
+        _, x2, y2 = points[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        best, best_index = 0.0, None
+        for i in range(first + 1, last):
+            _, x, y = points[i]
+            if length:
+                distance = abs(dy * (x - x1) - dx * (y - y1)) / length
+            else:
+                distance = math.hypot(x - x1, y - y1)
+            if distance > best:
+                best, best_index = distance, i
+        if best_index is not None and best > epsilon:
+            keep[best_index] = True
+            stack.append((first, best_index))
+            stack.append((best_index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def encode_move(points):
+    t0, x0, y0 = points[0]
+    parts = [f"Move {x0},{y0}"]
+    prev_ms, prev_x, prev_y = 0, x0, y0
+    for ts, x, y in points[1:]:
+        # Round offsets from the stroke start, not the deltas, so nothing drifts
+        at_ms = round((ts - t0) / 1_000_000)
+        parts.append(f"{x - prev_x},{y - prev_y},{at_ms - prev_ms}")
+        prev_ms, prev_x, prev_y = at_ms, x, y
+    return " ".join(parts)
+
+
+def decode_move(text):
+    """Return the absolute (at_ms, x, y) points of a Move block."""
+    tokens = text.split(" ")[1:]
+    x, y = (int(v) for v in tokens[0].split(","))
+    at_ms = 0
+    points = [(0, x, y)]
+    for token in tokens[1:]:
+        dx, dy, dt = (int(v) for v in token.split(","))
+        x, y, at_ms = x + dx, y + dy, at_ms + dt
+        points.append((at_ms, x, y))
+    return points
+
+
+def expand_move(points, rate_hz):
+    """Interpolate a decoded path into (at_ms, (x, y)) samples at rate_hz."""
+    step_ms = 1000 / rate_hz
+    samples = [(points[0][0], points[0][1:])]
+    for (t1, x1, y1), (t2, x2, y2) in zip(points, points[1:]):
+        span = t2 - t1
+        t = t1 + step_ms
+        while t < t2:
+            frac = (t - t1) / span
+            samples.append((t, (round(x1 + (x2 - x1) * frac), round(y1 + (y2 - y1) * frac))))
+            t += step_ms
+        samples.append((t2, (x2, y2)))
+    return samples
+
+
+def block_label(text):
+    if text.startswith("Move "):
+        return f"Move ({text.count(' ')} pts)"
+    if text.startswith("Loop "):
+        _, count, length = (text.split(" ") + ["?", "?"])[:3]
+        return f"Loop x{count} ({length} steps)"
+    return text
@@ -0,0 +1,428 @@
+import bisect
+from array import array
+
+from .compiler import MIN_SPEED, compile_blocks, expand_loops, parse_loop, retime_waits
+from .paths import DEFAULT_MOVE_RATE_HZ
+from .runtime import POLICY_IGNORE, REPEAT_MODES, REPEAT_ONCE, TRIGGER_POLICIES
+
+# -------------------------------------------------------
+#               MACRO PROFILE CLASS
+# -------------------------------------------------------
+FILE_VERSION = 2  # 1: bare list with "wait" in ms, 2: "wait_us" in microseconds
+
+
+KIND_OTHER = 0
+KIND_KEY = 1
+KIND_BUTTON = 2
+KIND_MOVE = 3
+KIND_SCROLL = 4
+KIND_LOOP = 5
+MAX_WAIT_US = 0xFFFFFFFF  # Waits are stored as uint32 microseconds (~71 min)
+
+
+def format_wait(wait_ms):
+    return f"{wait_ms:g} ms"
+
+
+def block_kind(text):
+    if text.startswith("Key "):
+        return KIND_KEY
+    if text.startswith("Button."):
+        return KIND_BUTTON
+    if text.startswith("Move "):
+        return KIND_MOVE
+    if text.startswith("Scroll "):
+        return KIND_SCROLL
+    if text.startswith("Loop "):
+        return KIND_LOOP
+    return KIND_OTHER
+
+
+def wait_to_us(wait_ms):
+    return min(max(round(wait_ms * 1000), 0), MAX_WAIT_US)
+
+
+class BlockList:
+    """Compact storage for a profile's (text, wait_ms) blocks.
+
+    Each step is one byte of kind, a uint32 index into a table of interned
+    block texts and a uint32 wait in microseconds. Reading a step builds the
+    (text, wait_ms) tuple on the fly, so callers can keep treating blocks as
+    a list of tuples.
+
+    Every step also gets an id that stays with it while steps around it are
+    added or removed. Ids are handed out in increasing order and only ever
+    reused to put a step back where it was, so step_ids stays sorted and
+    position() can bisect it instead of keeping a separate index.
+    """
+    __slots__ = ("kinds", "text_ids", "waits_us", "step_ids", "next_id",
+                 "texts", "text_kinds", "_ids_by_text")
+
+    def __init__(self, blocks=()):
+        self.kinds = array("B")
+        self.text_ids = array("I")
+        self.waits_us = array("I")
+        self.step_ids = array("I")
+        self.next_id = 0
+        self.texts = []        # Interned block texts, indexed by text id
+        self.text_kinds = []   # Kind of each interned text
+        self._ids_by_text = {}
+        self.extend(blocks)
+
+    @classmethod
+    def from_arrays(cls, texts, text_ids, waits_us, kinds=None):
+        """Adopt already decoded arrays, e.g. straight from a binary library."""
+        if text_ids and max(text_ids) >= len(texts):
+            raise ValueError("Step refers to a block text that does not exist")
+        blocks = cls()
+        for text in texts:
+            blocks.intern(text)
+        if len(blocks.texts) != len(texts):
+            raise ValueError("Duplicate block text in table")
+        blocks.text_ids = text_ids
+        blocks.waits_us = waits_us
+        if kinds is None:
+            kinds = array("B", map(blocks.text_kinds.__getitem__, text_ids))
+        blocks.kinds = kinds
+        blocks.step_ids = array("I", range(len(text_ids)))
+        blocks.next_id = len(text_ids)
+        return blocks
+
+    def intern(self, text):
+        text_id = self._ids_by_text.get(text)
+        if text_id is None:
+            text_id = len(self.texts)
+            self.texts.append(text)
+            self.text_kinds.append(block_kind(text))
+            self._ids_by_text[text] = text_id
+        return text_id
+
+    def __len__(self):
+        return len(self.waits_us)
+
+    def position(self, step_id):
+        """Current index of the step with this id."""
+        step_ids = self.step_ids
+        index = bisect.bisect_left(step_ids, step_id)
+        if index < len(step_ids) and step_ids[index] == step_id:
+            return index
+        # Only lists edited through the journal, e.g. an insert replayed at
+        # startup, can be out of order
+        return step_ids.index(step_id)
+
+    def loop_header(self, index):
+        """Index of the Loop block whose body holds the step at index, or None."""
+        if KIND_LOOP not in self.text_kinds:
+            return None
+        # Loops don't nest, so only the nearest Loop block before it can
+        header = bytes(self.kinds[:index]).rfind(KIND_LOOP)
+        if header < 0:
+            return None
+        loop = parse_loop(self.texts[self.text_ids[header]])
+        return header if loop is not None and index - header <= loop[1] else None
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.texts[self.text_ids[index]], self.waits_us[index] / 1000
+
+    def __iter__(self):
+        texts = self.texts
+        for text_id, wait_us in zip(self.text_ids, self.waits_us):
+            yield texts[text_id], wait_us / 1000
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"BlockList({list(self)!r})"
+
+    def __setitem__(self, index, block):
+        text, wait_ms = block
+        text_id = self.intern(text)
+        self.kinds[index] = self.text_kinds[text_id]
+        self.text_ids[index] = text_id
+        self.waits_us[index] = wait_to_us(wait_ms)
+
+    def __delitem__(self, index):
+        del self.kinds[index]
+        del self.text_ids[index]
+        del self.waits_us[index]
+        del self.step_ids[index]
+
+    def append(self, block):
+        text, wait_ms = block
+        text_id = self.intern(text)
+        self.kinds.append(self.text_kinds[text_id])
+        self.text_ids.append(text_id)
+        self.waits_us.append(wait_to_us(wait_ms))
+        self.step_ids.append(self.next_id)
+        self.next_id += 1
+
+    def extend(self, blocks):
+        for block in blocks:
+            self.append(block)
+
+    def insert(self, index, block):
+        self.insert_many(index, [block])
+
+    def insert_many(self, index, blocks, step_ids=None):
+        """Insert blocks before index in one move of the arrays.
+
+        step_ids puts back steps that were removed; new ids are handed out
+        otherwise.
+        """
+        kinds = array("B")
+        text_ids = array("I")
+        waits_us = array("I")
+        for text, wait_ms in blocks:
+            text_id = self.intern(text)
+            kinds.append(self.text_kinds[text_id])
+            text_ids.append(text_id)
+            waits_us.append(wait_to_us(wait_ms))
+        if step_ids is None:
+            step_ids = array("I", range(self.next_id, self.next_id + len(waits_us)))
+            self.next_id += len(waits_us)
+        self.kinds[index:index] = kinds
+        self.text_ids[index:index] = text_ids
+        self.waits_us[index:index] = waits_us
+        self.step_ids[index:index] = array("I", step_ids)
+
+    def pop(self, index=-1):
+        block = self[index]
+        del self[index]
+        return block
+
+    def copy(self):
+        blocks = BlockList()
+        blocks.kinds = self.kinds[:]
+        blocks.text_ids = self.text_ids[:]
+        blocks.waits_us = self.waits_us[:]
+        blocks.step_ids = self.step_ids[:]
+        blocks.next_id = self.next_id
+        blocks.texts = self.texts[:]
+        blocks.text_kinds = self.text_kinds[:]
+        blocks._ids_by_text = dict(self._ids_by_text)
+        return blocks
+
+    def clear(self):
+        del self.kinds[:]
+        del self.text_ids[:]
+        del self.waits_us[:]
+        del self.step_ids[:]  # next_id keeps counting, ids are never handed out twice
+        self.texts.clear()
+        self.text_kinds.clear()
+        self._ids_by_text.clear()
+
+
+class MacroProfile:
+    __slots__ = ("name", "_blocks", "assigned_button", "assigned_label",
+                 "trigger_policy", "max_instances", "move_rate_hz",
+                 "speed", "min_wait_ms", "max_wait_ms", "coalesce_ms", "turbo", "batch_text",
+                 "repeat_mode", "repeat_count", "repeat_gap_ms", "rate_limit",
+                 "revision", "_plan", "_plan_key", "_loader")
+
+    def __init__(self, name="New Macro"):
+        self.name = name
+        self._blocks = BlockList()  # (text, wait_ms) steps, wait_ms has microsecond resolution
+        self.assigned_button = None
+        self.assigned_label = "None"
+        self.trigger_policy = POLICY_IGNORE
+        self.max_instances = 1  # Parallel instances, or pending triggers for queue
+        self.move_rate_hz = DEFAULT_MOVE_RATE_HZ
+        # Playback timing, applied when compiling; the stored waits never change
+        self.speed = 1.0         # Waits and mouse paths are divided by this
+        self.min_wait_ms = 0.0
+        self.max_wait_ms = 0.0   # 0 means no upper clamp
+        self.coalesce_ms = 0.0   # Shorter waits are folded into the next longer one
+        self.turbo = False       # Fire steps back to back
+        self.batch_text = False  # Type runs of quick key taps in one injection
+        # Looping, applied by the runtime to the same compiled plan
+        self.repeat_mode = REPEAT_ONCE
+        self.repeat_count = 1      # Total plays in "count" mode
+        self.repeat_gap_ms = 0.0   # Pause between the end of one play and the next
+        self.rate_limit = 0.0      # Max injected events per second, 0 for no limit
+        self.revision = 0  # Bumped on every block edit
+        self._plan = None  # Compiled playback plan, see compiled()
+        self._plan_key = None  # Settings the cached plan was compiled with
+        self._loader = None  # Decodes the blocks on first access, see set_loader()
+
+    @property
+    def blocks(self):
+        # The hook thread may load a profile while the GUI evicts it, so read
+        # the field once and keep the loader around
+        blocks = self._blocks
+        if blocks is None:
+            blocks = self._blocks = self._loader()
+        return blocks
+
+    @blocks.setter
+    def blocks(self, blocks):
+        self._blocks = blocks if isinstance(blocks, BlockList) else BlockList(blocks)
+        self._loader = None
+        self._changed()
+
+    def set_loader(self, loader):
+        # Defer decoding the blocks until something reads them; also used to
+        # drop decoded blocks that are safely on disk
+        self._loader = loader
+        self._blocks = None
+        self._plan = None
+
+    def _changed(self):
+        self._plan = None
+        self.revision += 1
+
+    def is_loaded(self):
+        return self._blocks is not None
+
+    def add_block(self, text, wait_ms):
+        self.blocks.append((text, wait_ms))
+        self._changed()
+
+    def add_blocks(self, blocks):
+        self.blocks.extend(blocks)
+        self._changed()
+
+    def insert_blocks(self, index, blocks, step_ids=None):
+        self.blocks.insert_many(index, blocks, step_ids)
+        self._changed()
+
+    def remove_block(self, index):
+        if 0 <= index < len(self.blocks):
+            self.blocks.pop(index)
+            self._changed()
+
+    def remove_blocks(self, index, count):
+        del self.blocks[index:index + count]
+        self._changed()
+
+    def clear_blocks(self):
+        self.blocks.clear()
+        self._changed()
+
+    def timing_settings(self):
+        return {
+            "speed": self.speed,
+            "min_wait_ms": self.min_wait_ms,
+            "max_wait_ms": self.max_wait_ms,
+            "coalesce_ms": self.coalesce_ms,
+            "turbo": self.turbo,
+        }
+
+    def _compile_key(self, backend):
+        return (self.move_rate_hz, self.batch_text, backend, *self.timing_settings().values())
+
+    def cached_plan(self, backend=None):
+        """The compiled plan if it is still current; never compiles or loads blocks."""
+        plan = self._plan
+        if plan is not None and self._plan_key == self._compile_key(backend):
+            return plan
+        return None
+
+    def compiled(self, backend=None):
+        timing = self.timing_settings()
+        key = self._compile_key(backend)
+        if self._plan is None or self._plan_key != key:
+            blocks = self.blocks
+            if KIND_LOOP in blocks.text_kinds:
+                blocks = expand_loops(blocks)
+            blocks = retime_waits(blocks, **timing)
+            self._plan = compile_blocks(blocks, self.move_rate_hz, backend, path_speed=self.speed,
+                                        batch_text=self.batch_text)
+            self._plan_key = key
+        return self._plan
+
+    def settings_dict(self):
+        return {
+            "name": self.name,
+            "assigned_button": self.assigned_button,
+            "assigned_label": self.assigned_label,
+            "trigger_policy": self.trigger_policy,
+            "max_instances": self.max_instances,
+            "move_rate_hz": self.move_rate_hz,
+            **self.timing_settings(),
+            "batch_text": self.batch_text,
+            "repeat_mode": self.repeat_mode,
+            "repeat_count": self.repeat_count,
+            "repeat_gap_ms": self.repeat_gap_ms,
+            "rate_limit": self.rate_limit,
+        }
+
+    def apply_settings(self, data):
+        self.assigned_button = data.get("assigned_button")
+        self.assigned_label = data.get("assigned_label", "None")
+        self.trigger_policy = data.get("trigger_policy", POLICY_IGNORE)
+        if self.trigger_policy not in TRIGGER_POLICIES:
+            self.trigger_policy = POLICY_IGNORE
+        self.max_instances = data.get("max_instances", 1)
+        self.move_rate_hz = data.get("move_rate_hz", DEFAULT_MOVE_RATE_HZ)
+        self.speed = max(float(data.get("speed", 1.0)), MIN_SPEED)
+        self.min_wait_ms = max(float(data.get("min_wait_ms", 0.0)), 0.0)
+        self.max_wait_ms = max(float(data.get("max_wait_ms", 0.0)), 0.0)
+        self.coalesce_ms = max(float(data.get("coalesce_ms", 0.0)), 0.0)
+        self.turbo = bool(data.get("turbo", False))
+        self.batch_text = bool(data.get("batch_text", False))
+        self.repeat_mode = data.get("repeat_mode", REPEAT_ONCE)
+        if self.repeat_mode not in REPEAT_MODES:
+            self.repeat_mode = REPEAT_ONCE
+        self.repeat_count = max(int(data.get("repeat_count", 1)), 1)
+        self.repeat_gap_ms = max(float(data.get("repeat_gap_ms", 0.0)), 0.0)
+        self.rate_limit = max(float(data.get("rate_limit", 0.0)), 0.0)
+        self._plan = None
+
+    def copy(self):
+        profile = MacroProfile(self.name)
+        profile.apply_settings(self.settings_dict())
+        loader = self._loader
+        if self._blocks is None and loader is not None:
+            # Still mapped: share the loader, so whoever reads the copy decodes it
+            profile.set_loader(loader)
+        else:
+            profile.blocks = self.blocks.copy()
+        return profile
+
+    def to_dict(self):
+        blocks = self.blocks
+        texts = blocks.texts
+        data = self.settings_dict()
+        data["blocks"] = [
+            {"text": texts[text_id], "wait_us": wait_us}
+            for text_id, wait_us in zip(blocks.text_ids, blocks.waits_us)
+        ]
+        return data
+        
+    @classmethod
+    def from_dict(cls, data):
+        profile = cls(data["name"])
+        profile.apply_settings(data)
+        profile.add_blocks(
+            (b["text"], b["wait_us"] / 1000 if "wait_us" in b else b["wait"])
+            for b in data.get("blocks", [])
+        )
+        return profile
+
+
+def profiles_to_json(profiles):
+    return {
+        "format": "kzmacro",
+        "version": FILE_VERSION,
+        "profiles": [profile.to_dict() for profile in profiles],
+    }
+
+
+def profiles_from_json(data):
+    try:
+        if isinstance(data, list):  # Version 1 files are a bare list of profiles
+            return [MacroProfile.from_dict(d) for d in data]
+        if data.get("version", 0) > FILE_VERSION:
+            raise ValueError(f"File version {data['version']} is newer than this KzMacro supports")
+        return [MacroProfile.from_dict(d) for d in data.get("profiles", [])]
+    except (KeyError, TypeError, AttributeError) as e:
+        # Valid JSON, but not shaped like a profiles file
+        raise ValueError(f"Not a KzMacro profiles file ({type(e).__name__}: {e})") from e
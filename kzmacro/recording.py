@@ -0,0 +1,149 @@
+# -------------------------------------------------------
+#               RECORDING BUFFER
+# -------------------------------------------------------
+RING_CAPACITY = 1 << 16     # Events buffered per listener between drains
+DRAIN_INTERVAL_MS = 16      # GUI drains recorded events at about 60 Hz
+
+
+class EventRing:
+    """Lock-free single-producer/single-consumer ring of (timestamp_ns, text).
+
+    Each listener thread owns one ring and is its only writer; the GUI
+    thread is the only reader. head and tail only ever grow, and the writer
+    fills a slot before bumping head, so neither side needs a lock.
+    """
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.slots = [None] * capacity
+        self.mask = capacity - 1
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+    def push(self, item):
+        if self.head - self.tail > self.mask:
+            self.dropped += 1
+            return False
+        self.slots[self.head & self.mask] = item
+        self.head += 1
+        return True
+
+    def drain(self):
+        head = self.head
+        items = [self.slots[i & self.mask] for i in range(self.tail, head)]
+        self.tail = head
+        return items
+
+
+# -------------------------------------------------------
+#               RECORDING FILTER
+# -------------------------------------------------------
+DEBOUNCE_CHOICES_MS = (0, 10, 25, 50)
+
+
+class RecordFilter:
+    """Decides on the hook threads which input events get recorded.
+
+    Runs before anything is buffered, so a dropped event never becomes a
+    block. Key methods are only called from the keyboard hook thread and
+    mouse methods only from the mouse one, so each side keeps its own state
+    and counters. The GUI may flip the options at any time.
+    """
+
+    def __init__(self):
+        self.collapse_repeats = True  # OS auto-repeat of a held key becomes one hold
+        self.ignore_window = True     # Clicks, scrolls and moves over KzMacro itself
+        self.exclude_hotkeys = True   # Assigned hotkeys and the stop key
+        self.debounce_ms = 0          # Drop a re-press this soon after the release
+        self.window_rect = None       # (left, top, right, bottom) in screen pixels
+        self.reset()
+
+    def reset(self, excluded=()):
+        self.excluded = frozenset(excluded)
+        self.keys_down = set()
+        self.keys_skipped = {}        # Name -> why its Down was dropped; its Up goes too
+        self.key_released_ns = {}
+        self.buttons_down = set()
+        self.buttons_skipped = {}
+        self.button_released_ns = {}
+        self.key_dropped = {}
+        self.mouse_dropped = {}
+
+    def dropped(self):
+        """Dropped event counts by reason."""
+        counts = dict(self.key_dropped)
+        for reason, count in self.mouse_dropped.items():
+            counts[reason] = counts.get(reason, 0) + count
+        return counts
+
+    def _bounced(self, released_ns, name, ts_ns):
+        released = released_ns.get(name)
+        return bool(self.debounce_ms) and released is not None and ts_ns - released < self.debounce_ms * 1_000_000
+
+    @staticmethod
+    def _count(dropped, reason):
+        dropped[reason] = dropped.get(reason, 0) + 1
+
+    def in_window(self, x, y):
+        rect = self.window_rect
+        return self.ignore_window and rect is not None and rect[0] <= x < rect[2] and rect[1] <= y < rect[3]
+
+    # ---------------- keyboard thread ----------------
+    def key_down(self, name, ts_ns):
+        if name in self.keys_skipped:
+            reason = self.keys_skipped[name]  # Auto-repeat of a dropped key
+        elif name in self.keys_down:
+            if not self.collapse_repeats:
+                return True
+            reason = "repeat"
+        elif self.exclude_hotkeys and name in self.excluded:
+            reason = self.keys_skipped[name] = "hotkey"
+        elif self._bounced(self.key_released_ns, name, ts_ns):
+            reason = self.keys_skipped[name] = "debounce"
+        else:
+            self.keys_down.add(name)
+            return True
+        self._count(self.key_dropped, reason)
+        return False
+
+    def key_up(self, name, ts_ns):
+        self.key_released_ns[name] = ts_ns
+        if name in self.keys_down:
+            self.keys_down.discard(name)
+            return True
+        # Its Down was dropped, or it was already held when recording started
+        self._count(self.key_dropped, self.keys_skipped.pop(name, "unmatched"))
+        return False
+
+    # ---------------- mouse thread ----------------
+    def click(self, x, y, button, pressed, ts_ns):
+        if not pressed:
+            self.button_released_ns[button] = ts_ns
+            if button in self.buttons_down:
+                self.buttons_down.discard(button)
+                return True
+            self._count(self.mouse_dropped, self.buttons_skipped.pop(button, "unmatched"))
+            return False
+
+        if self.exclude_hotkeys and button in self.excluded:
+            reason = "hotkey"
+        elif self.in_window(x, y):
+            reason = "window"
+        elif self._bounced(self.button_released_ns, button, ts_ns):
+            reason = "debounce"
+        else:
+            self.buttons_down.add(button)
+            return True
+        self.buttons_skipped[button] = reason
+        self._count(self.mouse_dropped, reason)
+        return False
+
+    def move(self, x, y):
+        # Not counted: moves are thinned out later anyway
+        return not self.in_window(x, y)
+
+    def scroll(self, x, y):
+        if self.in_window(x, y):
+            self._count(self.mouse_dropped, "window")
+            return False
+        return True
@@ -0,0 +1,398 @@
+import sys
+import time
+import threading
+import collections
+import heapq
+
+from .backends import default_backend
+from .compiler import OP_KEY_PRESS, OP_KEY_RELEASE, OP_BUTTON_PRESS, OP_BUTTON_RELEASE
+from .events import Signal
+from .metrics import Metrics
+
+# -------------------------------------------------------
+#               MACRO RUNTIME
+# -------------------------------------------------------
+# Sleeping is only accurate to a few ms (~15 ms for timed waits on Windows),
+# so the runtime sleeps until shortly before a deadline and spins the rest.
+SPIN_WINDOW_S = 0.016 if sys.platform == "win32" else 0.002
+MAX_SPIN_WINDOW_S = 0.025
+STOP_HOTKEY = "Key.esc"  # Default stop key, aborts playback from anywhere
+STOP_KEY_CHOICES = [STOP_HOTKEY, "Key.pause", "Key.scroll_lock", "Key.f12", None]  # None: no stop key
+ECHO_WINDOW_S = 0.25  # How long the hooks may take to report a press playback injected
+PROGRESS_INTERVAL_S = 0.05  # Throttle progress signals to the GUI
+LATENCY_HISTORY = 100
+
+# What happens when a profile is triggered while it is already playing
+POLICY_IGNORE = "ignore"      # Drop the new trigger
+POLICY_RESTART = "restart"    # Stop the running instance and start over
+POLICY_QUEUE = "queue"        # Play again once the current run ends
+POLICY_PARALLEL = "parallel"  # Start another instance alongside
+TRIGGER_POLICIES = [POLICY_IGNORE, POLICY_RESTART, POLICY_QUEUE, POLICY_PARALLEL]
+
+# How many times a run plays its plan
+REPEAT_ONCE = "once"      # Play once
+REPEAT_COUNT = "count"    # Play repeat_count times
+REPEAT_HOLD = "hold"      # Loop while the hotkey is held down
+REPEAT_TOGGLE = "toggle"  # Loop until triggered again
+REPEAT_MODES = [REPEAT_ONCE, REPEAT_COUNT, REPEAT_HOLD, REPEAT_TOGGLE]
+MAX_LATENESS_SAMPLES = 100_000  # Per-run TimingReport input; looping runs can go on for hours
+
+
+class TimingReport:
+    def __init__(self, lateness_s):
+        lateness_ms = sorted(x * 1000 for x in lateness_s)
+        self.steps = len(lateness_ms)
+        if lateness_ms:
+            self.mean_ms = sum(lateness_ms) / self.steps
+            self.p99_ms = lateness_ms[max(0, -(-self.steps * 99 // 100) - 1)]
+            self.max_ms = lateness_ms[-1]
+        else:
+            self.mean_ms = self.p99_ms = self.max_ms = 0.0
+
+    def __str__(self):
+        return (f"{self.steps} steps, lateness mean {self.mean_ms:.3f} ms, "
+                f"p99 {self.p99_ms:.3f} ms, max {self.max_ms:.3f} ms")
+
+
+class MacroRun:
+    __slots__ = ("run_id", "profile", "plan", "base", "index", "held",
+                 "lateness", "triggered_at", "last_progress", "stopped", "metrics",
+                 "repeats_left", "iteration", "gap_s", "min_interval", "last_deadline")
+
+    def __init__(self, run_id, profile, plan, triggered_at, metrics):
+        self.run_id = run_id
+        self.profile = profile
+        self.plan = plan
+        self.metrics = metrics  # The profile's ProfileMetrics
+        # Offsets count from the trigger itself, so the first step is already due
+        self.base = triggered_at
+        self.triggered_at = triggered_at
+        self.index = 0
+        self.held = []
+        self.lateness = []
+        self.last_progress = 0.0
+        self.stopped = False
+        mode = profile.repeat_mode
+        if mode == REPEAT_COUNT:
+            self.repeats_left = max(1, profile.repeat_count) - 1
+        elif mode in (REPEAT_HOLD, REPEAT_TOGGLE):
+            self.repeats_left = None  # Until stopped
+        else:
+            self.repeats_left = 0
+        self.iteration = 0
+        self.gap_s = profile.repeat_gap_ms / 1000
+        rate = profile.rate_limit
+        self.min_interval = 1 / rate if rate > 0 else 0.0
+        self.last_deadline = float("-inf")  # Scheduled time of the step fired last
+
+    def next_deadline(self):
+        deadline = self.base + self.plan[self.index][2] / 1000
+        if self.min_interval:
+            # Rate limit against the schedule rather than the clock, so one
+            # late step doesn't push back everything after it
+            deadline = max(deadline, self.last_deadline + self.min_interval)
+        return deadline
+
+    def next_iteration(self):
+        """Rewind to the start of the plan if another repeat is due."""
+        if self.repeats_left == 0:
+            return False
+        if self.repeats_left is not None:
+            self.repeats_left -= 1
+        self.iteration += 1
+        self.index = 0
+        # Each iteration starts where the last one was scheduled to end, so
+        # hours of looping never accumulate wake-up lateness
+        self.base = self.last_deadline + self.gap_s
+        return True
+
+
+class MacroRuntime:
+    """Plays any number of macros at once from a single thread.
+
+    Every running macro keeps exactly one entry in a deadline heap: the time
+    its next step is due. The thread sleeps until the earliest deadline,
+    spins the last stretch, fires that step and pushes the run's next one,
+    so thousands of pending steps cost one sleeping thread. trigger() can be
+    called from any thread, including straight from a hook callback.
+
+    Signals fire on the runtime thread, or on the caller's for pause/stop.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or default_backend()  # Injects every step
+        self.run_started = Signal()       # (run id, profile name)
+        self.run_finished = Signal()      # (run id, profile name)
+        self.step_played = Signal()       # (run id, steps done, total steps)
+        self.paused_changed = Signal()    # (paused)
+        self.timing_report = Signal()     # (profile name, TimingReport)
+        self.latency_measured = Signal()  # Trigger to first injection, ms
+        self._thread = None
+        self._cond = threading.Condition()
+        self._commands = []
+        self._instances = {}  # id(profile) -> runs started and not yet finished
+        self._queued = {}     # id(profile) -> triggers waiting (queue policy)
+        self._paused = False
+        self._shutdown = False
+        self._next_run_id = 0
+        self.spin_window = SPIN_WINDOW_S
+        self.latencies_ms = collections.deque(maxlen=LATENCY_HISTORY)
+        self.metrics = Metrics()  # Histograms the runtime thread records into
+        self.echo_target = None  # Native stop key; injected presses of it are noted
+        self._echoes = collections.deque()  # When each of those presses was injected
+
+    # ---------------- called from any thread ----------------
+    def trigger(self, profile, triggered_at=None):
+        """Start profile according to its trigger policy. Returns False if dropped.
+
+        Uses the cached plan when it is current. After an edit or a setting
+        change the runtime thread compiles it instead, so a hook callback
+        never waits on compiling or decoding a large macro.
+        """
+        if triggered_at is None:
+            triggered_at = time.perf_counter()
+        plan = profile.cached_plan(self.backend)
+        if plan is not None and not plan:
+            return False
+        key = id(profile)
+        limit = max(1, profile.max_instances)
+        with self._cond:
+            active = self._instances.get(key, 0)
+            if active:
+                if profile.repeat_mode == REPEAT_TOGGLE:
+                    self._stop_profile_locked(key)
+                    return False
+                if profile.repeat_mode == REPEAT_HOLD:
+                    return False  # Key auto-repeat while the hotkey is held
+                policy = profile.trigger_policy
+                if policy == POLICY_RESTART:
+                    self._commands.append(("stop_profile", key))
+                elif policy == POLICY_QUEUE:
+                    if self._queued.get(key, 0) >= limit:
+                        return False
+                    self._queued[key] = self._queued.get(key, 0) + 1
+                    return True
+                elif policy != POLICY_PARALLEL or active >= limit:
+                    return False
+            self._start_locked(profile, plan, triggered_at)
+            self._cond.notify()
+        return True
+
+    def _start_locked(self, profile, plan, triggered_at):
+        self._next_run_id += 1
+        self._instances[id(profile)] = self._instances.get(id(profile), 0) + 1
+        run = MacroRun(self._next_run_id, profile, plan, triggered_at, self.metrics.profile(profile.name))
+        self._commands.append(("start", run))
+
+    def is_echo(self):
+        """Whether a stop key press the hooks just reported came from playback.
+
+        Hooks see injected input like any other, so a macro that presses the
+        stop key would otherwise stop itself. Call once per press.
+        """
+        now = time.perf_counter()
+        echoes = self._echoes
+        while echoes and now - echoes[0] > ECHO_WINDOW_S:
+            echoes.popleft()  # The hooks never reported it
+        if echoes:
+            echoes.popleft()
+            return True
+        return False
+
+    def release(self, profile):
+        """The profile's hotkey was let go: ends a repeat-while-held run."""
+        if profile.repeat_mode == REPEAT_HOLD:
+            with self._cond:
+                if self._instances.get(id(profile)):
+                    self._stop_profile_locked(id(profile))
+
+    def _stop_profile_locked(self, key):
+        self._queued.pop(key, None)
+        self._commands.append(("stop_profile", key))
+        self._cond.notify()
+
+    def is_busy(self):
+        with self._cond:
+            return any(self._instances.values())
+
+    def is_paused(self):
+        return self._paused
+
+    def set_paused(self, paused):
+        with self._cond:
+            self._paused = paused
+            self._cond.notify()
+        self.paused_changed.emit(paused)
+
+    def stop(self):
+        """Stop every running macro and drop queued triggers."""
+        with self._cond:
+            self._queued.clear()
+            self._commands.append(("stop_all", None))
+            self._paused = False
+            self._cond.notify()
+        self.paused_changed.emit(False)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="macro-runtime", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(1)
+
+    # ---------------- runtime thread ----------------
+    def run(self):
+        actions = self.backend.actions()
+        heap = []  # (deadline, run id, MacroRun)
+        runs = {}
+        paused_at = None
+        while True:
+            expected_wake = None
+            with self._cond:
+                while not (self._commands or self._shutdown):
+                    if self._paused or not heap:
+                        self._cond.wait()
+                        continue
+                    timeout = heap[0][0] - time.perf_counter() - self.spin_window
+                    if timeout <= 0:
+                        break
+                    expected_wake = time.perf_counter() + timeout
+                    self._cond.wait(timeout)
+                commands, self._commands = self._commands, []
+                paused = self._paused
+                shutdown = self._shutdown
+
+            for command, arg in commands:
+                if command == "start":
+                    if arg.plan is None:
+                        try:
+                            arg.plan = arg.profile.compiled(self.backend)
+                        except Exception as e:
+                            print(f"Could not play {arg.profile.name}: {e}")
+                            arg.plan = []
+                        if not arg.plan:
+                            # Nothing to play after all: just give back its instance slot
+                            self._release(arg)
+                            continue
+                        # Play the offsets from now, or every step due during the
+                        # compile would fire at once. Latency still counts from
+                        # the trigger.
+                        arg.base = time.perf_counter()
+                    runs[arg.run_id] = arg
+                    heapq.heappush(heap, (arg.next_deadline(), arg.run_id, arg))
+                    self.run_started.emit(arg.run_id, arg.profile.name)
+                elif command == "stop_profile":
+                    for run in list(runs.values()):
+                        if id(run.profile) == arg:
+                            self._finish(actions, run, runs)
+                elif command == "stop_all":
+                    for run in list(runs.values()):
+                        self._finish(actions, run, runs)
+
+            if shutdown:
+                for run in list(runs.values()):
+                    self._finish(actions, run, runs)
+                return
+
+            if paused:
+                if paused_at is None:
+                    paused_at = time.perf_counter()
+                continue
+            if paused_at is not None:
+                # Push every pending deadline back by the time spent paused.
+                # A uniform shift keeps the heap ordered.
+                delta = time.perf_counter() - paused_at
+                paused_at = None
+                for run in runs.values():
+                    run.base += delta
+                    run.last_deadline += delta
+                heap = [(deadline + delta, run_id, run) for deadline, run_id, run in heap]
+
+            if not heap:
+                continue
+            deadline, _, run = heap[0]
+            now = time.perf_counter()
+            if expected_wake is not None and not commands:
+                # Widen the spin window if the OS woke us up past the deadline
+                overshoot = now - expected_wake
+                if overshoot > self.spin_window:
+                    self.spin_window = min(overshoot * 1.5, MAX_SPIN_WINDOW_S)
+            if deadline - now > self.spin_window:
+                continue
+            if run.stopped:
+                heapq.heappop(heap)
+                continue
+            while time.perf_counter() < deadline:
+                # Yield the GIL each pass so hook and socket threads can still
+                # trigger while a run is spinning towards its deadline
+                time.sleep(0)
+            heapq.heappop(heap)
+            self._fire(actions, run, deadline)
+            if run.index < len(run.plan) or run.next_iteration():
+                heapq.heappush(heap, (run.next_deadline(), run.run_id, run))
+            else:
+                self._finish(actions, run, runs)
+
+    def _fire(self, actions, run, deadline):
+        op, target, at_ms = run.plan[run.index]
+        fired = time.perf_counter()
+        lateness = fired - deadline
+        run.last_deadline = deadline
+        if len(run.lateness) < MAX_LATENESS_SAMPLES:
+            run.lateness.append(lateness)
+        metrics = run.metrics
+        metrics.step_lateness.record(lateness)
+        if target == self.echo_target and op in (OP_KEY_PRESS, OP_BUTTON_PRESS):
+            self._echoes.append(fired)  # Before injecting: the hook may report it at once
+        try:
+            actions[op](target)
+        except Exception as e:
+            print(f"Error playing {target}: {e}")
+        injected = time.perf_counter()
+        metrics.injection.record(injected - fired)
+        if run.index == 0 and run.iteration == 0:
+            metrics.trigger_latency.record(injected - run.triggered_at)
+            latency_ms = (injected - run.triggered_at) * 1000
+            self.latencies_ms.append(latency_ms)
+            self.latency_measured.emit(latency_ms)
+        if op in (OP_KEY_PRESS, OP_BUTTON_PRESS):
+            run.held.append((op, target))
+        elif op in (OP_KEY_RELEASE, OP_BUTTON_RELEASE) and (op - 1, target) in run.held:
+            run.held.remove((op - 1, target))
+        run.index += 1
+
+        total = len(run.plan)
+        if fired - run.last_progress >= PROGRESS_INTERVAL_S or run.index == total:
+            run.last_progress = fired
+            self.step_played.emit(run.run_id, run.index, total)
+
+    def _finish(self, actions, run, runs):
+        run.stopped = True
+        runs.pop(run.run_id, None)
+        # Never leave keys or buttons stuck down when stopped mid-macro
+        for op, target in reversed(run.held):
+            try:
+                actions[op + 1](target)
+            except Exception as e:
+                print(f"Error releasing {target}: {e}")
+        run.held.clear()
+
+        report = TimingReport(run.lateness)
+        print(f"Playback timing for {run.profile.name}: {report}")
+        self.timing_report.emit(run.profile.name, report)
+        self.run_finished.emit(run.run_id, run.profile.name)
+        self._release(run)
+
+    def _release(self, run):
+        key = id(run.profile)
+        with self._cond:
+            self._instances[key] -= 1
+            if not self._instances[key]:
+                del self._instances[key]
+            if self._queued.get(key) and not self._shutdown:
+                self._queued[key] -= 1
+                self._start_locked(run.profile, run.profile.cached_plan(self.backend), time.perf_counter())
@@ -0,0 +1,508 @@
+import sys
+import os
+import json
+import hashlib
+import threading
+import collections
+import mmap
+import shutil
+import struct
+from array import array
+
+from .profile import BlockList, MacroProfile, profiles_from_json, profiles_to_json
+
+# -------------------------------------------------------
+#                BINARY LIBRARY FORMAT
+# -------------------------------------------------------
+# A .kzm file is little-endian throughout:
+#
+#   header     magic "KZMB", u16 version, u16 flags, u32 profile count,
+#              u64 offset of the profile directory
+#   per profile, in file order:
+#     texts    u32 length + UTF-8 bytes for every interned block text
+#     steps    8-byte aligned records of u32 text id, u32 wait_us
+#     kinds    one byte per step, the block kind of its text
+#   directory  one entry per profile: u64 texts offset, u32 text count,
+#              u64 steps offset, u32 step count, u32 settings length,
+#              followed by the profile settings as UTF-8 JSON
+#
+# Opening a library only parses the header and directory; a profile's
+# texts and steps are decoded from the memory map the first time its
+# blocks are read.
+BINARY_MAGIC = b"KZMB"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sHHIQ")
+BINARY_ENTRY = struct.Struct("<QIQII")
+BINARY_TEXT_LEN = struct.Struct("<I")
+BINARY_STEP_SIZE = 8
+
+
+def _pad_to(f, alignment):
+    padding = -f.tell() % alignment
+    if padding:
+        f.write(b"\0" * padding)
+
+
+def write_binary_library(path, profiles):
+    tmp_path = path + ".tmp"
+    entries = []
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * BINARY_HEADER.size)
+        for profile in profiles:
+            blocks = profile.blocks
+            texts_offset = f.tell()
+            for text in blocks.texts:
+                data = text.encode("utf-8")
+                f.write(BINARY_TEXT_LEN.pack(len(data)))
+                f.write(data)
+            _pad_to(f, BINARY_STEP_SIZE)
+            steps_offset = f.tell()
+            records = array("I", bytes(len(blocks) * BINARY_STEP_SIZE))
+            records[0::2] = blocks.text_ids
+            records[1::2] = blocks.waits_us
+            if sys.byteorder == "big":
+                records.byteswap()
+            records.tofile(f)
+            blocks.kinds.tofile(f)
+            settings = json.dumps(profile.settings_dict()).encode("utf-8")
+            entries.append((texts_offset, len(blocks.texts), steps_offset, len(blocks), settings))
+        directory_offset = f.tell()
+        for texts_offset, text_count, steps_offset, step_count, settings in entries:
+            f.write(BINARY_ENTRY.pack(texts_offset, text_count, steps_offset, step_count, len(settings)))
+            f.write(settings)
+        f.seek(0)
+        f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(entries), directory_offset))
+        f.flush()
+        os.fsync(f.fileno())
+    # Replace in one step so a failed save never leaves a half-written library
+    os.replace(tmp_path, path)
+
+
+class BinaryLibrary:
+    """Memory-mapped .kzm file handing out profiles that decode on first use."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            self._file.close()
+            raise ValueError(f"{path} is not a KzMacro library")
+        try:
+            self.profiles = self._read_directory()
+        except Exception:
+            self.close()
+            raise
+
+    def _read_directory(self):
+        mm = self._map
+        if len(mm) < BINARY_HEADER.size:
+            raise ValueError(f"{self.path} is not a KzMacro library")
+        magic, version, _flags, count, offset = BINARY_HEADER.unpack_from(mm, 0)
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"{self.path} is not a KzMacro library")
+        if version > BINARY_VERSION:
+            raise ValueError(f"Library version {version} is newer than this KzMacro supports")
+        profiles = []
+        for _ in range(count):
+            texts_offset, text_count, steps_offset, step_count, settings_len = \
+                BINARY_ENTRY.unpack_from(mm, offset)
+            offset += BINARY_ENTRY.size
+            settings = json.loads(mm[offset:offset + settings_len].decode("utf-8"))
+            offset += settings_len
+            if steps_offset + step_count * (BINARY_STEP_SIZE + 1) > len(mm):
+                raise ValueError(f"Profile {settings.get('name')!r} runs past the end of the file")
+            profile = MacroProfile(settings["name"])
+            profile.apply_settings(settings)
+            profile.set_loader(self._loader(texts_offset, text_count, steps_offset, step_count))
+            profiles.append(profile)
+        return profiles
+
+    def _loader(self, texts_offset, text_count, steps_offset, step_count):
+        def load():
+            return self._decode(texts_offset, text_count, steps_offset, step_count)
+        return load
+
+    def _decode(self, texts_offset, text_count, steps_offset, step_count):
+        mm = self._map
+        texts = []
+        pos = texts_offset
+        for _ in range(text_count):
+            (length,) = BINARY_TEXT_LEN.unpack_from(mm, pos)
+            pos += BINARY_TEXT_LEN.size
+            texts.append(mm[pos:pos + length].decode("utf-8"))
+            pos += length
+        kinds_offset = steps_offset + step_count * BINARY_STEP_SIZE
+        records = array("I")
+        records.frombytes(mm[steps_offset:kinds_offset])
+        if sys.byteorder == "big":
+            records.byteswap()
+        kinds = array("B")
+        kinds.frombytes(mm[kinds_offset:kinds_offset + step_count])
+        return BlockList.from_arrays(texts, records[0::2], records[1::2], kinds)
+
+    def load_all(self):
+        for profile in self.profiles:
+            profile.blocks  # Decodes anything still mapped
+        
+    def close(self):
+        # Profiles that were never read can't be decoded after this
+        self._map.close()
+        self._file.close()
+
+
+def read_binary_library(path):
+    library = BinaryLibrary(path)
+    try:
+        library.load_all()
+    finally:
+        library.close()
+    return library.profiles
+
+
+def is_binary_library(path):
+    return path.lower().endswith(".kzm")
+
+
+def convert_library(src, dst):
+    """Convert between the JSON and binary formats, picked by file extension."""
+    if is_binary_library(src):
+        profiles = read_binary_library(src)
+    else:
+        with open(src, "r") as f:
+            profiles = profiles_from_json(json.load(f))
+    if is_binary_library(dst):
+        write_binary_library(dst, profiles)
+    else:
+        with open(dst, "w") as f:
+            json.dump(profiles_to_json(profiles), f, indent=2)
+    return len(profiles)
+
+
+# -------------------------------------------------------
+#                   PROFILE LIBRARY
+# -------------------------------------------------------
+# profiles/ holds one .kzm file per profile and index.json listing each
+# profile's settings, step count, content hash and file. Startup reads only
+# the index; a profile's file is decoded when it is selected or triggered,
+# and least recently used profiles are dropped again once they are safely
+# on disk.
+#
+# On top of that every edit is appended to journal-<gen>.log as one JSON
+# line. Compaction starts a new journal generation, then on a background
+# thread writes new files for profiles whose blocks changed and finally
+# replaces the index, which records the generation it covers. Files the
+# new index no longer references are deleted afterwards. Recovery reads the
+# index and replays every journal of its generation or later, so a crash at
+# any point loses at most the last unflushed line.
+#
+# Replacing every profile at once (loading a file) writes them to
+# import-<gen>.kzm and journals a replace_profiles record naming it, so the
+# edits after it are never replayed onto the profiles it replaced.
+LIBRARY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "profiles")
+LIBRARY_INDEX = "index.json"
+LIBRARY_VERSION = 1
+COMPACT_AFTER_BYTES = 4 * 1024 * 1024  # Journal size that triggers a compaction
+MAX_LOADED_PROFILES = 32  # Decoded profiles kept in memory
+
+
+def apply_journal_record(profiles, record):
+    op = record["op"]
+    if op == "add_profile":
+        profiles.append(MacroProfile(record["name"]))
+    elif op == "delete_profile":
+        profiles.pop(record["profile"])
+    elif op == "settings":
+        profile = profiles[record["profile"]]
+        profile.name = record["settings"]["name"]
+        profile.apply_settings(record["settings"])
+    elif op == "add_blocks":
+        profiles[record["profile"]].add_blocks(
+            (text, wait_us / 1000) for text, wait_us in record["blocks"]
+        )
+    elif op == "insert_blocks":
+        profiles[record["profile"]].insert_blocks(
+            record["index"], [(text, wait_us / 1000) for text, wait_us in record["blocks"]]
+        )
+    elif op == "remove_block":
+        profiles[record["profile"]].remove_block(record["index"])
+    elif op == "remove_blocks":
+        profiles[record["profile"]].remove_blocks(record["index"], record["count"])
+    elif op == "clear_blocks":
+        profiles[record["profile"]].clear_blocks()
+    else:
+        raise ValueError(f"Unknown journal record {op!r}")
+
+
+def blocks_hash(blocks):
+    digest = hashlib.sha1()
+    for text in blocks.texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(blocks.text_ids.tobytes())
+    digest.update(blocks.waits_us.tobytes())
+    return digest.hexdigest()
+
+
+def read_profile_file(path):
+    library = BinaryLibrary(path)
+    try:
+        return library.profiles[0].blocks
+    finally:
+        library.close()
+
+
+class ProfileLibrary:
+    def __init__(self, directory=LIBRARY_DIR):
+        self.directory = directory
+        self.generation = 0
+        self.entries = {}    # profile -> its index entry, replaced as a whole
+        self.revisions = {}  # profile -> block revision its file holds
+        self.loaded = collections.OrderedDict()  # Decoded profiles, oldest first
+        self._file = None
+        self._size = 0
+        self._compactor = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _journal_path(self, generation):
+        return self._path(f"journal-{generation:06d}.log")
+
+    def _generations(self, kind):
+        generations = []
+        for name in os.listdir(self.directory):
+            prefix, _, rest = name.partition("-")
+            number, _, _ext = rest.partition(".")
+            if prefix == kind and number.isdigit():
+                generations.append(int(number))
+        return sorted(generations)
+
+    def _loader(self, entry):
+        name = entry["file"]
+
+        def load():
+            try:
+                return read_profile_file(self._path(name))
+            except FileNotFoundError:
+                # Another process (the editor, for a read-only daemon)
+                # compacted since this entry was read and removed the file
+                current = self._current_file(entry.get("id"))
+                if current is None or current == name:
+                    raise
+                return read_profile_file(self._path(current))
+        return load
+
+    def _current_file(self, profile_id):
+        """The file the index on disk now gives for a profile id, if any."""
+        try:
+            with open(self._path(LIBRARY_INDEX), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        for entry in index.get("profiles", ()):
+            if entry.get("id") == profile_id:
+                return entry["file"]
+        return None
+
+    def open(self, read_only=False):
+        """Rebuild the last saved state and open a fresh journal for new edits.
+
+        read_only replays the journals without opening a new one, for
+        processes that only play macros while the editor owns the library.
+        """
+        if read_only and not os.path.isdir(self.directory):
+            return [], 0
+        if not read_only:
+            os.makedirs(self.directory, exist_ok=True)
+        profiles = []
+        base = 0
+        index_path = self._path(LIBRARY_INDEX)
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("version", 0) > LIBRARY_VERSION:
+                raise ValueError(f"Library version {index['version']} is newer than this KzMacro supports")
+            base = index["generation"]
+            entries = {}
+            for entry in index["profiles"]:
+                profile = MacroProfile(entry["name"])
+                profile.apply_settings(entry)
+                profile.set_loader(self._loader(entry))
+                entries[profile] = entry
+                profiles.append(profile)
+            self.entries = entries
+            self.revisions = {profile: profile.revision for profile in profiles}
+
+        replayed = 0
+        journals = [g for g in self._generations("journal") if g >= base]
+        for generation in journals:
+            with open(self._journal_path(generation), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash; nothing after it was flushed
+                        print(f"Journal {generation} ends in a partial record, skipping it")
+                        break
+                    if record["op"] == "replace_profiles":
+                        profiles[:] = read_binary_library(self._path(record["file"]))
+                    else:
+                        apply_journal_record(profiles, record)
+                    replayed += 1
+
+        self.generation = max([base] + journals) + 1
+        if not read_only:
+            self._open_journal()
+        if replayed:
+            print(f"Recovered {replayed} unsaved edits from the autosave journal")
+        return profiles, replayed
+
+    def _open_journal(self):
+        self._file = open(self._journal_path(self.generation), "a", encoding="utf-8")
+        self._size = 0
+
+    def append(self, op, **fields):
+        fields["op"] = op
+        line = json.dumps(fields, separators=(",", ":")) + "\n"
+        self._file.write(line)
+        self._file.flush()
+        self._size += len(line)
+
+    def replace_all(self, profiles, source=None):
+        """Journal that profiles replace the whole library, then compact.
+
+        source is a .kzm file holding exactly these profiles. It is copied
+        rather than encoded again, so profiles still mapped from it stay
+        undecoded on this thread.
+        """
+        self.wait()
+        name = f"import-{self.generation:06d}.kzm"
+        path = self._path(name)
+        if source is not None:
+            shutil.copyfile(source, path + ".tmp")
+            with open(path + ".tmp", "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+        else:
+            write_binary_library(path, profiles)
+        self.append("replace_profiles", file=name)
+        self.entries, self.revisions = {}, {}
+        current = set(profiles)
+        for old in [profile for profile in self.loaded if profile not in current]:
+            del self.loaded[old]
+        self.compact(profiles)
+
+    def touch(self, profile):
+        """Mark a profile as used and drop the blocks of the least recent ones."""
+        self.loaded[profile] = None
+        self.loaded.move_to_end(profile)
+        excess = len(self.loaded) - MAX_LOADED_PROFILES
+        if excess <= 0:
+            return
+        entries, revisions = self.entries, self.revisions
+        for old in list(self.loaded)[:-1]:
+            if excess <= 0:
+                break
+            # Edits not yet compacted only exist in memory and the journal
+            if old in entries and revisions.get(old) == old.revision:
+                old.set_loader(self._loader(entries[old]))
+                del self.loaded[old]
+                excess -= 1
+
+    def forget(self, profile):
+        self.loaded.pop(profile, None)
+
+    def needs_compaction(self):
+        return self._size >= COMPACT_AFTER_BYTES and not self.is_compacting()
+
+    def is_compacting(self):
+        return self._compactor is not None and self._compactor.is_alive()
+
+    def compact(self, profiles):
+        if self.is_compacting():
+            return False
+        plan = []
+        for profile in profiles:
+            entry = self.entries.get(profile)
+            if entry is not None and (not profile.is_loaded()
+                                      or self.revisions.get(profile) == profile.revision):
+                # Blocks on disk are current, only the settings may have changed
+                plan.append((profile, dict(entry, **profile.settings_dict()), None, profile.revision))
+            else:
+                # Copy on this thread so later edits can't race the writer;
+                # block storage is flat arrays, so this is a handful of memcpys.
+                # A profile still mapped from a loaded .kzm is decoded by the
+                # writer instead, so keep that file open until wait() returns.
+                # The copy has its own revision, so keep the profile's.
+                plan.append((profile, entry, profile.copy(), profile.revision))
+        self._file.close()
+        self.generation += 1
+        self._open_journal()
+        self._compactor = threading.Thread(
+            target=self._write, args=(self.generation, plan), name="library-compactor"
+        )
+        self._compactor.start()
+        return True
+
+    def _write(self, generation, plan):
+        entries = {}
+        revisions = {}
+        try:
+            for profile, entry, snapshot, revision in plan:
+                if snapshot is not None:
+                    digest = blocks_hash(snapshot.blocks)
+                    if entry is None or entry["hash"] != digest:
+                        profile_id = entry["id"] if entry else os.urandom(8).hex()
+                        entry = {"id": profile_id, "file": f"{profile_id}-{generation:06d}.kzm",
+                                 "hash": digest}
+                        write_binary_library(self._path(entry["file"]), [snapshot])
+                    entry = dict(entry, **snapshot.settings_dict(), steps=len(snapshot.blocks))
+                    revisions[profile] = revision
+                else:
+                    revisions[profile] = self.revisions.get(profile)
+                entries[profile] = entry
+
+            index_path = self._path(LIBRARY_INDEX)
+            with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({
+                    "format": "kzmacro-library",
+                    "version": LIBRARY_VERSION,
+                    "generation": generation,
+                    "profiles": [entries[profile] for profile, *_ in plan],
+                }, f, indent=1)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(index_path + ".tmp", index_path)
+        except Exception as e:
+            # The journals are still complete, the next compaction retries
+            print(f"Library compaction failed: {e}")
+            return
+
+        self.entries, self.revisions = entries, revisions
+
+        referenced = {entry["file"] for entry in entries.values()}
+        for name in os.listdir(self.directory):
+            prefix, _, rest = name.partition("-")
+            number, _, ext = rest.partition(".")
+            stale = (
+                (ext == "kzm" and prefix != "import" and name not in referenced)
+                or (prefix in ("journal", "import") and number.isdigit() and int(number) < generation)
+            )
+            if stale:
+                try:
+                    os.remove(self._path(name))
+                except OSError as e:
+                    print(f"Could not remove old library file: {e}")
+
+    def wait(self):
+        """Block until a running compaction has finished."""
+        if self._compactor is not None:
+            self._compactor.join()
+
+    def close(self):
+        self.wait()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,189 +1,593 @@
+import re
 import sys
 import time
 import json
-import os
+import heapq
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QPushButton, QVBoxLayout, QHBoxLayout,
-    QLabel, QScrollArea, QFrame, QFileDialog, QLineEdit,
-    QListWidget, QListWidgetItem, QMessageBox, QSplitter, QInputDialog
+    QLabel, QFileDialog, QLineEdit,
+    QMessageBox, QSplitter, QInputDialog,
+    QComboBox, QSpinBox, QDoubleSpinBox, QCheckBox, QListView, QStyledItemDelegate, QStyle,
+    QTableWidget, QTableWidgetItem, QAbstractItemView, QMenu
 )
-from PyQt6.QtCore import Qt, pyqtSignal, QThread
-from pynput import keyboard, mouse
-from PyQt6.QtGui import QFont, QIcon
+from PyQt6.QtCore import (
+    Qt, pyqtSignal, QObject, QAbstractListModel, QModelIndex, QSortFilterProxyModel,
+    QSize, QRect, QEvent, QTimer
+)
+from PyQt6.QtGui import QFont, QIcon, QColor, QPainter, QActionGroup, QKeySequence, QShortcut
+
+from kzmacro.backends import default_backend
+from kzmacro.compiler import parse_loop
+from kzmacro.history import EDIT_DELETE, EDIT_INSERT, EDIT_SWAP, EditHistory
+from kzmacro.hotkeys import HotkeyDispatcher
+from kzmacro.metrics import PROFILE_METRICS, export_metrics, mean_us, quantile_us
+from kzmacro.optimizer import estimate_runtime_ms, optimize_blocks
+from kzmacro.paths import MOVE_MIN_INTERVAL_NS, STROKE_GAP_NS, simplify_path, encode_move, block_label
+from kzmacro.runtime import (
+    MacroRuntime, STOP_HOTKEY, STOP_KEY_CHOICES, TRIGGER_POLICIES,
+    REPEAT_ONCE, REPEAT_COUNT, REPEAT_HOLD, REPEAT_TOGGLE, REPEAT_MODES,
+)
+from kzmacro.recording import DEBOUNCE_CHOICES_MS, DRAIN_INTERVAL_MS, EventRing, RecordFilter
+from kzmacro.profile import BlockList, MacroProfile, format_wait, profiles_to_json, profiles_from_json
+from kzmacro.storage import LIBRARY_DIR, BinaryLibrary, ProfileLibrary, is_binary_library, write_binary_library
 
 # -------------------------------------------------------
-#               MACRO BLOCK (UI ELEMENT)
+#               TIMELINE MODEL / VIEW
 # -------------------------------------------------------
-class MacroBlock(QFrame):
-    def __init__(self, text: str, wait_ms: int, remove_callback):
+BLOCK_SIZE = QSize(105, 40)
+BLOCK_BG = QColor("#22313f")
+BLOCK_BORDER = QColor("#0e141a")
+DELETE_BG = QColor("#9c2b2b")
+DELETE_HOVER_BG = QColor("#c23737")
+STEP_ID_ROLE = Qt.ItemDataRole.UserRole + 1
+
+
+class TimelineModel(QAbstractListModel):
+    """List model over the current profile's blocks; the profile is the only copy.
+
+    Every edit goes through here: it changes the profile, tells the view
+    which rows moved, and records how to undo it in that profile's history.
+    """
+
+    # Emitted after an edit so the autosave journal can record it
+    blocks_inserted = pyqtSignal(object, int, int)  # profile, first row, count
+    blocks_removed = pyqtSignal(object, int, int)   # profile, first row, count
+    blocks_cleared = pyqtSignal(object)             # profile
+    history_changed = pyqtSignal()
+
+    def __init__(self):
         super().__init__()
-        self.remove_callback = remove_callback
-        self.text = text
-        self.wait_ms = wait_ms
+        self.profile = None
+        self.histories = {}  # Profile -> EditHistory, created on its first edit
+
+    def set_profile(self, profile):
+        self.beginResetModel()
+        self.profile = profile
+        self.endResetModel()
+        self.history_changed.emit()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() or self.profile is None:
+            return 0
+        return len(self.profile.blocks)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or self.profile is None:
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            text, wait_ms = self.profile.blocks[index.row()]
+            return f"{block_label(text)}\n{format_wait(wait_ms)}"
+        if role == Qt.ItemDataRole.UserRole:
+            return self.profile.blocks[index.row()]
+        if role == STEP_ID_ROLE:
+            return self.profile.blocks.step_ids[index.row()]
+        return None
+
+    # ---------------- edits ----------------
+    def append_blocks(self, blocks):
+        history = self.history()
+        first_id = self.profile.blocks.next_id
+        self.insert_steps(len(self.profile.blocks), blocks)
+        self.record(history, (EDIT_DELETE, first_id, len(blocks)))
+
+    def remove_step(self, step_id):
+        history = self.history()
+        blocks = self.profile.blocks
+        header = blocks.loop_header(blocks.position(step_id))
+        edits = [self.delete_steps(step_id, 1)]
+        if header is not None:
+            # A Loop block counts the steps after it, so it would otherwise
+            # take in whatever follows its body
+            edits += self.shrink_loop(header)
+        for i, edit in enumerate(edits):
+            self.record(history, edit, joined=i > 0)
+
+    def shrink_loop(self, row):
+        """Make the Loop block at row one step shorter; returns the undo edits."""
+        blocks = self.profile.blocks
+        text, wait_ms = blocks[row]
+        count, length = parse_loop(text)
+        header_id = blocks.step_ids[row]
+        edits = [self.delete_steps(header_id, 1)]
+        if length > 1:
+            self.insert_steps(row, [(f"Loop {count} {length - 1}", wait_ms)], [header_id])
+            edits.append((EDIT_DELETE, header_id, 1))
+        return edits
+
+    def clear(self):
+        self.replace_blocks(BlockList())
+
+    def replace_blocks(self, blocks):
+        history = self.history()
+        self.record(history, self.swap_blocks(blocks))
+
+    def insert_steps(self, row, blocks, step_ids=None):
+        self.beginInsertRows(QModelIndex(), row, row + len(blocks) - 1)
+        self.profile.insert_blocks(row, blocks, step_ids)
+        self.endInsertRows()
+        self.blocks_inserted.emit(self.profile, row, len(blocks))
+
+    def delete_steps(self, first_id, count):
+        blocks = self.profile.blocks
+        row = blocks.position(first_id)
+        removed = [(*blocks[i], blocks.step_ids[i]) for i in range(row, row + count)]
+        self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+        self.profile.remove_blocks(row, count)
+        self.endRemoveRows()
+        self.blocks_removed.emit(self.profile, row, count)
+        return (EDIT_INSERT, row, removed)
+
+    def swap_blocks(self, blocks):
+        # Journals as a clear plus an insert, so autosave needs no new record
+        previous = self.profile.blocks
+        self.beginResetModel()
+        self.profile.blocks = blocks
+        self.endResetModel()
+        self.blocks_cleared.emit(self.profile)
+        if len(self.profile.blocks):
+            self.blocks_inserted.emit(self.profile, 0, len(self.profile.blocks))
+        return (EDIT_SWAP, previous)
+
+    def apply_edit(self, edit):
+        """Carry out an edit from the history; returns the edit that reverses it."""
+        if edit[0] == EDIT_INSERT:
+            _, row, steps = edit
+            self.insert_steps(row, [step[:2] for step in steps], [step[2] for step in steps])
+            return (EDIT_DELETE, steps[0][2], len(steps))
+        if edit[0] == EDIT_DELETE:
+            return self.delete_steps(edit[1], edit[2])
+        return self.swap_blocks(edit[1])
+
+    # ---------------- history ----------------
+    def history(self):
+        history = self.histories.get(self.profile)
+        if history is not None and history.blocks is not self.profile.blocks:
+            # Blocks were set from outside or reloaded from disk, so the
+            # recorded step ids no longer refer to them
+            history = None
+        if history is None:
+            history = self.histories[self.profile] = EditHistory(self.profile.blocks)
+        return history
+
+    def record(self, history, edit, joined=False):
+        history.push(edit, joined)
+        history.blocks = self.profile.blocks
+        self.history_changed.emit()
+
+    def begin_group(self):
+        self.history().begin_group()
+
+    def end_group(self):
+        self.history().end_group()
+
+    def can_undo(self):
+        return self.profile is not None and self.history().can_undo()
+
+    def can_redo(self):
+        return self.profile is not None and self.history().can_redo()
+
+    def undo(self):
+        history = self.history()
+        if history.can_undo():
+            entry = history.take_undo()
+            history.redo_stack.append([self.apply_edit(edit) for edit in reversed(entry)])
+            history.blocks = self.profile.blocks
+            self.history_changed.emit()
+
+    def redo(self):
+        history = self.history()
+        if history.can_redo():
+            entry = history.take_redo()
+            history.undo_stack.append([self.apply_edit(edit) for edit in reversed(entry)])
+            history.blocks = self.profile.blocks
+            self.history_changed.emit()
+
+    def forget(self, profile):
+        self.histories.pop(profile, None)
+
+    def forget_all(self):
+        self.histories.clear()
+        self.history_changed.emit()
+
+
+class TimelineDelegate(QStyledItemDelegate):
+    """Paints a block the way the old MacroBlock frame looked, without a widget."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.font = QFont()
+        self.font.setPixelSize(11)
+
+    def sizeHint(self, option, index):
+        return BLOCK_SIZE
+
+    def delete_rect(self, rect):
+        return QRect(rect.right() - 5 - 18, rect.bottom() - 2 - 16, 18, 16)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        rect = option.rect.adjusted(0, 0, -1, -1)
+        painter.setPen(BLOCK_BORDER)
+        painter.setBrush(BLOCK_BG)
+        painter.drawRoundedRect(rect, 8, 8)
+
+        painter.setFont(self.font)
+        painter.setPen(Qt.GlobalColor.white)
+        text_rect = rect.adjusted(5, 2, -5, -14)
+        painter.drawText(text_rect, Qt.AlignmentFlag.AlignCenter, index.data())
+
+        hovered = option.state & QStyle.StateFlag.State_MouseOver
+        delete_rect = self.delete_rect(rect)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(DELETE_HOVER_BG if hovered else DELETE_BG)
+        painter.drawRoundedRect(delete_rect, 7, 7)
+        painter.setPen(Qt.GlobalColor.white)
+        painter.drawText(delete_rect, Qt.AlignmentFlag.AlignCenter, "X")
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if (event.type() == QEvent.Type.MouseButtonRelease
+                and self.delete_rect(option.rect.adjusted(0, 0, -1, -1)).contains(event.position().toPoint())):
+            model.remove_step(index.data(STEP_ID_ROLE))
+            return True
+        return False
 
-        self.setStyleSheet("""
-            QFrame {
-                background-color: #22313f;
-                border: 1px solid #0e141a;
-                border-radius: 8px;
-            }
-            QLabel { 
-                color: white; 
-                font-size: 11px;
-                background-color: transparent;
-            }
-            QPushButton {
-                background-color: #9c2b2b;
-                color: white;
-                border-radius: 7px;
-                padding: 0px;
-                border: none;
-            }
-            QPushButton:hover { background-color: #c23737; }
-        """)
 
-        self.setFixedSize(105, 40)
+# -------------------------------------------------------
+#               PROFILE SIDEBAR MODEL
+# -------------------------------------------------------
+CONFLICT_COLOR = QColor("#ffb347")
 
-        layout = QVBoxLayout()
-        layout.setContentsMargins(5, 2, 5, 2)
 
-        self.lbl = QLabel(f"{self.text}\n{self.wait_ms} ms")
-        self.lbl.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        layout.addWidget(self.lbl)
-        self.delete = QPushButton("X")
-        self.delete.setFixedSize(18, 16)
-        self.delete.clicked.connect(self.del_self)
-        layout.addWidget(self.delete, alignment=Qt.AlignmentFlag.AlignRight)
+def profile_search_text(profile):
+    # One line per field, so a fuzzy match never spans name and key
+    if profile.assigned_button:
+        return f"{profile.name}\n{profile.assigned_label}".lower()
+    return profile.name.lower()
 
-        self.setLayout(layout)
 
-    def del_self(self):
-        self.remove_callback(self)
-        self.deleteLater()
+def fuzzy_pattern(query):
+    """Regex matching text that has the query's characters in order."""
+    return re.compile(".*?".join(map(re.escape, query)))
 
-    def export(self):
-        return {"text": self.text, "wait": self.wait_ms}
+
+class ProfileListModel(QAbstractListModel):
+    """Sidebar rows over the editor's profile list, which stays the only copy."""
+
+    def __init__(self, profiles):
+        super().__init__()
+        self.profiles = profiles
+        self.conflicts = {}  # Profile -> other profiles on the same hotkey
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.profiles)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        profile = self.profiles[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"⚠ {profile.name}" if profile in self.conflicts else profile.name
+        if role == Qt.ItemDataRole.ToolTipRole:
+            others = self.conflicts.get(profile)
+            if others:
+                names = ", ".join(other.name for other in others)
+                return f"{profile.assigned_label} is also assigned to {names}"
+            return f"Assigned: {profile.assigned_label}" if profile.assigned_button else None
+        if role == Qt.ItemDataRole.ForegroundRole and profile in self.conflicts:
+            return CONFLICT_COLOR
+        return None
+
+    def index_of(self, profile):
+        return self.index(self.profiles.index(profile))
+
+    def append(self, profile):
+        row = len(self.profiles)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.profiles.append(profile)
+        self.endInsertRows()
+
+    def remove(self, profile):
+        row = self.profiles.index(profile)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.profiles[row]
+        self.endRemoveRows()
+
+    def replace(self, profiles):
+        self.beginResetModel()
+        self.profiles[:] = profiles
+        self.conflicts = {}
+        self.endResetModel()
+
+    def profile_changed(self, profile):
+        index = self.index_of(profile)
+        self.dataChanged.emit(index, index)
+
+    def set_conflicts(self, conflicts):
+        """Take the hotkey -> profiles conflicts; only rows whose flag changed repaint."""
+        flagged = {}
+        for owners in conflicts.values():
+            for profile in owners:
+                flagged[profile] = [other for other in owners if other is not profile]
+        changed = [profile for profile in flagged.keys() | self.conflicts.keys()
+                   if flagged.get(profile) != self.conflicts.get(profile)]
+        self.conflicts = flagged
+        for profile in changed:
+            if profile in self.profiles:
+                self.profile_changed(profile)
+
+
+class ProfileFilterProxy(QSortFilterProxyModel):
+    """Fuzzy filter over profile names and assigned keys.
+
+    Typing usually narrows the query, and text that did not match a query
+    cannot match a longer one, so rejected texts are remembered until the
+    query stops extending the previous one.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.query = ""
+        self.pattern = None
+        self.rejected = set()  # Search texts that fail the current query
+
+    def set_query(self, text):
+        query = text.strip().lower()
+        if query == self.query:
+            return
+        if not query.startswith(self.query):
+            self.rejected = set()
+        self.query = query
+        self.pattern = fuzzy_pattern(query) if query else None
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.pattern is None:
+            return True
+        text = profile_search_text(self.sourceModel().profiles[source_row])
+        if text in self.rejected:
+            return False
+        if self.pattern.search(text):
+            return True
+        self.rejected.add(text)
+        return False
 
 
 # -------------------------------------------------------
-#               KEY LISTENER THREAD
+#               ENGINE SIGNALS
 # -------------------------------------------------------
-class GlobalKeyListener(QThread):
-    key_pressed = pyqtSignal(str)
-    
-    def __init__(self, assigned_key=None):
+class EngineSignals(QObject):
+    """Qt mirror of the runtime and dispatcher signals.
+
+    The engine emits on its own threads; re-emitting through a QObject that
+    lives on the GUI thread queues every handler onto the event loop.
+    """
+    run_started = pyqtSignal(int, str)
+    run_finished = pyqtSignal(int, str)
+    step_played = pyqtSignal(int, int, int)
+    paused_changed = pyqtSignal(bool)
+    timing_report = pyqtSignal(str, object)
+    latency_measured = pyqtSignal(float)
+    triggered = pyqtSignal(object, bool)
+    captured = pyqtSignal(str)
+
+    def __init__(self, runtime, dispatcher):
         super().__init__()
-        self.assigned_key = assigned_key
-        self.assigned_mouse_button = None
-        self.listener = None
-        self.mouse_listener = None
-        
-    def run(self):
-        self.running = True
-        
-        def on_key_press(key):
-            if not self.running:
-                return
-                
-            try:
-                k = key.char
-            except AttributeError:
-                k = str(key)
-            
-            if self.assigned_key and k == self.assigned_key:
-                self.key_pressed.emit(k)
-        
-        def on_click(x, y, button, pressed):
-            if not self.running or not pressed:
-                return
-            mouse_str = str(button)
-            
-            if self.assigned_mouse_button and mouse_str == self.assigned_mouse_button:
-                self.key_pressed.emit(mouse_str)
-
-        self.listener = keyboard.Listener(on_press=on_key_press)
-        self.mouse_listener = mouse.Listener(on_click=on_click)
-        
-        self.listener.start()
-        self.mouse_listener.start()
-        while self.running:
-            time.sleep(0.1)
-        
-    def set_assigned_button(self, button_str):
-        if button_str.startswith("Button."):
-            self.assigned_mouse_button = button_str
-            self.assigned_key = None
-        else:
-            self.assigned_key = button_str
-            self.assigned_mouse_button = None
-        
-    def stop(self):
-        self.running = False
-        if self.listener:
-            self.listener.stop()
-        if self.mouse_listener:
-            self.mouse_listener.stop()
+        for name in ("run_started", "run_finished", "step_played", "paused_changed",
+                     "timing_report", "latency_measured"):
+            getattr(runtime, name).connect(getattr(self, name).emit)
+        dispatcher.triggered.connect(self.triggered.emit)
+        dispatcher.captured.connect(self.captured.emit)
 
 
 # -------------------------------------------------------
-#               MACRO PROFILE CLASS
+#               STATS PANEL
 # -------------------------------------------------------
-class MacroProfile:
-    def __init__(self, name="New Macro"):
-        self.name = name
-        self.blocks = []  # List of (text, wait_ms)
-        self.assigned_button = None
-        self.assigned_label = "None"
-        
-    def add_block(self, text, wait_ms):
-        self.blocks.append((text, wait_ms))
-        
-    def remove_block(self, index):
-        if 0 <= index < len(self.blocks):
-            self.blocks.pop(index)
-            
-    def clear_blocks(self):
-        self.blocks.clear()
-        
-    def to_dict(self):
-        return {
-            "name": self.name,
-            "assigned_button": self.assigned_button,
-            "assigned_label": self.assigned_label,
-            "blocks": [{"text": t, "wait": w} for t, w in self.blocks]
-        }
-        
-    @classmethod
-    def from_dict(cls, data):
-        profile = cls(data["name"])
-        profile.assigned_button = data.get("assigned_button")
-        profile.assigned_label = data.get("assigned_label", "None")
-        profile.blocks = [(b["text"], b["wait"]) for b in data.get("blocks", [])]
-        return profile
+STATS_REFRESH_MS = 500
+LISTENER_LABELS = {
+    "hotkey_key": "Hotkey dispatch (keyboard)",
+    "hotkey_mouse": "Hotkey dispatch (mouse)",
+    "record_key": "Recorder callback (keyboard)",
+    "record_mouse": "Recorder callback (mouse)",
+}
+
+
+def format_us(us):
+    return f"{us / 1000:.3f} ms"
+
+
+class StatsPanel(QWidget):
+    """Latency histograms from the runtime and the input hooks.
+
+    Only polls the metrics while it is visible; recording them costs the
+    same whether the panel is open or not.
+    """
+    COLUMNS = ["Source", "Metric", "Count", "Mean", "p50", "p99", "Max"]
+
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        header = QHBoxLayout()
+        title = QLabel("Latency statistics")
+        title.setStyleSheet("font-size: 12px; color: #cccccc;")
+        header.addWidget(title)
+        header.addStretch()
+        reset_btn = QPushButton("Reset")
+        reset_btn.clicked.connect(self.reset)
+        header.addWidget(reset_btn)
+        export_btn = QPushButton("Export...")
+        export_btn.setToolTip("Write a Prometheus text file (.prom) or append a JSON line (.jsonl)")
+        export_btn.clicked.connect(self.export)
+        header.addWidget(export_btn)
+        layout.addLayout(header)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setFixedHeight(180)
+        self.table.setStyleSheet("""
+            QTableWidget {
+                background-color: #151e27;
+                border: 1px solid #22313f;
+                gridline-color: #22313f;
+            }
+            QHeaderView::section {
+                background-color: #22313f;
+                color: white;
+                border: none;
+                padding: 4px;
+            }
+        """)
+        layout.addWidget(self.table)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(STATS_REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        snapshot = self.metrics.snapshot()
+        rows = []
+        for profile, histograms in snapshot["profiles"].items():
+            for name, label in PROFILE_METRICS.items():
+                rows.append((profile, label, histograms[name]))
+        for name, histogram in snapshot["listeners"].items():
+            rows.append(("Input hooks", LISTENER_LABELS.get(name, name), histogram))
+
+        self.table.setRowCount(len(rows))
+        for row, (source, label, histogram) in enumerate(rows):
+            values = [
+                source, label, str(histogram["count"]),
+                format_us(mean_us(histogram)),
+                format_us(quantile_us(histogram, 0.5)),
+                format_us(quantile_us(histogram, 0.99)),
+                format_us(histogram["max_us"]),
+            ]
+            for column, value in enumerate(values):
+                item = self.table.item(row, column)
+                if item is None:
+                    item = QTableWidgetItem()
+                    self.table.setItem(row, column, item)
+                item.setText(value)
+
+    def reset(self):
+        self.metrics.reset()
+        self.refresh()
+
+    def export(self):
+        file_path, selected_filter = QFileDialog.getSaveFileName(
+            self, "Export Metrics", "", "Prometheus Text (*.prom);;JSON Lines (*.jsonl)"
+        )
+        if not file_path:
+            return
+        if not file_path.lower().endswith(('.prom', '.jsonl')):
+            file_path += '.prom' if 'prom' in selected_filter else '.jsonl'
+        try:
+            export_metrics(file_path, self.metrics.snapshot())
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Failed to export: {str(e)}")
 
 
 # -------------------------------------------------------
 #                    MAIN EDITOR
 # -------------------------------------------------------
-class MacroEditor(QWidget):
-    new_key_event = pyqtSignal(str)
-    new_mouse_event = pyqtSignal(str)
+REPEAT_LABELS = {
+    REPEAT_ONCE: "Once",
+    REPEAT_COUNT: "Count",
+    REPEAT_HOLD: "While held",
+    REPEAT_TOGGLE: "Toggle",
+}
 
-    def __init__(self):
+
+def format_runtime(ms):
+    return f"{ms / 1000:.2f} s" if ms >= 1000 else f"{ms:.0f} ms"
+
+
+def stop_key_label(name):
+    if name is None:
+        return "None"
+    return name.replace("Key.", "").replace("_", " ").title()
+
+
+class MacroEditor(QWidget):
+    def __init__(self, backend=None, library_dir=LIBRARY_DIR):
         super().__init__()
 
         self.setWindowTitle("KzMacro")
         self.resize(1200, 600)
 
         self.macro_assigned_button = None
-        self.current_profile_index = 0
-        self.profiles = [MacroProfile("Default Macro")]
+        self.current_profile = None  # Profile shown in the editor
+        self.profiles = []
+        self.library = None  # Open BinaryLibrary the profiles were mapped from
+        self.profile_library = ProfileLibrary(library_dir)
+        replayed = 0
+        try:
+            self.profiles, replayed = self.profile_library.open()
+        except Exception as e:
+            # Leave the damaged files alone rather than journal on top of them
+            print(f"Could not open the profile library, autosave is off this session: {e}")
+            self.profile_library.close()
+            self.profile_library = None
+            self.profiles = []
         self.recording = False
-        self.last_event_time = time.time()
+        self.last_event_ns = time.monotonic_ns()
+        self.key_ring = EventRing()    # Written by the keyboard listener only
+        self.mouse_ring = EventRing()  # Written by the mouse listener only
+        self.record_filter = RecordFilter()  # Drops noise on the hook threads
+        self.record_timer = QTimer(self)
+        self.record_timer.setInterval(DRAIN_INTERVAL_MS)
+        self.record_timer.timeout.connect(self.drain_recording)
+        self.record_moves = True
+        self.last_move = None     # (timestamp_ns, x, y) of the newest raw sample
+        self.last_move_pushed = True
+        self.last_move_push_ns = 0
+        self.stroke = []          # Raw move samples of the stroke being recorded
         
-        # Global key/mouse listener
-        self.global_listener = None
-        self.is_listening = False
+        # Background playback thread
+        self.backend = backend or default_backend()
+        self.runtime = MacroRuntime(self.backend)
+        self.active_runs = {}  # run id -> (profile name, steps done, total)
+        self.last_timing_report = None
+
+        # Global hotkeys for every profile
+        self.dispatcher = HotkeyDispatcher(self.runtime)
+        self.engine_signals = EngineSignals(self.runtime, self.dispatcher)
 
         # Main layout
         main_layout = QHBoxLayout()
@@ -193,23 +597,6 @@ class MacroEditor(QWidget):
                 background-color: #1c252e;
                 color: white;
             }
-            QListWidget {
-                background-color: #151e27;
-                border: none;
-                color: white;
-                font-size: 12px;
-            }
-            QListWidget::item {
-                padding: 8px;
-                border-bottom: 1px solid #22313f;
-            }
-            QListWidget::item:selected {
-                background-color: #2c60ff;
-                color: white;
-            }
-            QListWidget::item:hover {
-                background-color: #22313f;
-            }
             QPushButton {
                 background-color: #33414d;
                 color: white;
@@ -254,19 +641,51 @@ class MacroEditor(QWidget):
         sidebar_title.setAlignment(Qt.AlignmentFlag.AlignCenter)
         sidebar_layout.addWidget(sidebar_title)
 
-        # Profile list
-        self.profile_list = QListWidget()
+        # Search as you type, over names and assigned keys
+        self.profile_search = QLineEdit()
+        self.profile_search.setPlaceholderText("Search name or key...")
+        self.profile_search.setClearButtonEnabled(True)
+        sidebar_layout.addWidget(self.profile_search)
+
+        # Profile list; the model reads self.profiles directly
+        if not self.profiles:
+            self.profiles.append(MacroProfile("Default Macro"))
+            self.autosave("add_profile", name="Default Macro")
+        self.profile_model = ProfileListModel(self.profiles)
+        self.profile_proxy = ProfileFilterProxy(self)
+        self.profile_proxy.setSourceModel(self.profile_model)
+        self.profile_search.textChanged.connect(self.profile_proxy.set_query)
+        self.profile_list = QListView()
+        self.profile_list.setModel(self.profile_proxy)
+        self.profile_list.setUniformItemSizes(True)
         self.profile_list.setStyleSheet("""
-            QListWidget {
+            QListView {
                 background-color: #151e27;
                 border: 1px solid #22313f;
                 border-radius: 4px;
+                color: white;
+                font-size: 12px;
+            }
+            QListView::item {
+                padding: 8px;
+                border-bottom: 1px solid #22313f;
+            }
+            QListView::item:selected {
+                background-color: #2c60ff;
+                color: white;
+            }
+            QListView::item:hover {
+                background-color: #22313f;
             }
         """)
-        self.profile_list.addItem("Default Macro")
-        self.profile_list.currentRowChanged.connect(self.switch_profile)
+        self.profile_list.selectionModel().currentChanged.connect(self.on_profile_selected)
         sidebar_layout.addWidget(self.profile_list)
 
+        self.conflict_lbl = QLabel("")
+        self.conflict_lbl.setWordWrap(True)
+        self.conflict_lbl.setStyleSheet("color: #ffb347;")
+        sidebar_layout.addWidget(self.conflict_lbl)
+
         # Sidebar buttons
         btn_layout = QVBoxLayout()
         btn_layout.setSpacing(5)
@@ -342,6 +761,15 @@ class MacroEditor(QWidget):
         self.stop_btn.setEnabled(False)
         btn_row.addWidget(self.stop_btn)
 
+        self.record_moves_chk = QCheckBox("Record movement")
+        self.record_moves_chk.setChecked(True)
+        btn_row.addWidget(self.record_moves_chk)
+
+        self.filters_btn = QPushButton("Filters")
+        self.filters_btn.setToolTip("What to leave out of recordings")
+        self.filters_btn.setMenu(self.build_filter_menu())
+        btn_row.addWidget(self.filters_btn)
+
         self.assign_btn = QPushButton("Assign to Key/Mouse Button")
         self.assign_btn.clicked.connect(self.assign_button)
         self.assign_btn.setStyleSheet("""
@@ -368,18 +796,59 @@ class MacroEditor(QWidget):
         content_layout.addLayout(btn_row)
 
         # --------------- SCROLL AREA (TIMELINE) ------------
+        timeline_header = QHBoxLayout()
         timeline_label = QLabel("Macro Timeline")
         timeline_label.setStyleSheet("font-size: 12px; color: #cccccc; margin-top: 10px;")
-        content_layout.addWidget(timeline_label)
-
-        self.scroll = QScrollArea()
-        self.scroll.setWidgetResizable(True)
-        self.scroll.setFixedHeight(280)
-        self.scroll.setStyleSheet("""
-            QScrollArea {
+        timeline_header.addWidget(timeline_label)
+        timeline_header.addStretch()
+
+        self.optimize_lbl = QLabel("")
+        self.optimize_lbl.setStyleSheet("color: #cccccc;")
+        timeline_header.addWidget(self.optimize_lbl)
+
+        self.optimize_btn = QPushButton("Optimize")
+        self.optimize_btn.setToolTip("Turn quick presses into clicks, merge scrolls and mouse strokes, "
+                                     "and fold repeated sequences into loops")
+        self.optimize_btn.clicked.connect(self.optimize_profile)
+        timeline_header.addWidget(self.optimize_btn)
+
+        self.undo_btn = QPushButton("Undo")
+        self.undo_btn.setToolTip("Undo the last timeline edit (Ctrl+Z)")
+        self.undo_btn.clicked.connect(self.undo_edit)
+        timeline_header.addWidget(self.undo_btn)
+
+        self.redo_btn = QPushButton("Redo")
+        self.redo_btn.setToolTip("Redo the last undone edit (Ctrl+Y)")
+        self.redo_btn.clicked.connect(self.redo_edit)
+        timeline_header.addWidget(self.redo_btn)
+        QShortcut(QKeySequence.StandardKey.Undo, self, self.undo_edit)
+        QShortcut(QKeySequence.StandardKey.Redo, self, self.redo_edit)
+        content_layout.addLayout(timeline_header)
+
+        # Only the visible blocks are painted, so huge macros stay responsive
+        self.timeline_model = TimelineModel()
+        self.timeline_model.blocks_inserted.connect(self.on_blocks_inserted)
+        self.timeline_model.blocks_removed.connect(self.on_blocks_removed)
+        self.timeline_model.blocks_cleared.connect(self.on_blocks_cleared)
+        self.timeline_model.history_changed.connect(self.update_undo_buttons)
+        self.timeline_view = QListView()
+        self.timeline_view.setModel(self.timeline_model)
+        self.timeline_view.setItemDelegate(TimelineDelegate(self.timeline_view))
+        self.timeline_view.setFlow(QListView.Flow.LeftToRight)
+        self.timeline_view.setWrapping(True)
+        self.timeline_view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.timeline_view.setUniformItemSizes(True)
+        self.timeline_view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.timeline_view.setSpacing(3)
+        self.timeline_view.setSelectionMode(QListView.SelectionMode.NoSelection)
+        self.timeline_view.setMouseTracking(True)
+        self.timeline_view.setFixedHeight(280)
+        self.timeline_view.setStyleSheet("""
+            QListView {
                 background-color: #151e27;
                 border: 1px solid #22313f;
                 border-radius: 6px;
+                padding: 7px;
             }
             QScrollBar:vertical {
                 background-color: #22313f;
@@ -395,23 +864,14 @@ class MacroEditor(QWidget):
                 background-color: #3a6fff;
             }
         """)
-
-        self.timeline_container = QWidget()
-        self.timeline_layout = QHBoxLayout()
-        self.timeline_layout.setAlignment(Qt.AlignmentFlag.AlignLeft)
-        self.timeline_layout.setSpacing(5)
-        self.timeline_layout.setContentsMargins(10, 10, 10, 10)
-        self.timeline_container.setLayout(self.timeline_layout)
-
-        self.scroll.setWidget(self.timeline_container)
-        content_layout.addWidget(self.scroll)
+        content_layout.addWidget(self.timeline_view)
 
         # ---------------- PLAYBACK CONTROLS ----------------
         playback_layout = QHBoxLayout()
         playback_layout.setSpacing(10)
         
         self.play_btn = QPushButton("▶ Play Macro")
-        self.play_btn.clicked.connect(self.play_macro)
+        self.play_btn.clicked.connect(lambda: self.play_macro())
         self.play_btn.setStyleSheet("""
             QPushButton {
                 background-color: #2cff88;
@@ -423,6 +883,25 @@ class MacroEditor(QWidget):
             QPushButton:hover { background-color: #3aff95; }
         """)
         playback_layout.addWidget(self.play_btn)
+
+        self.pause_btn = QPushButton("❚❚ Pause")
+        self.pause_btn.clicked.connect(self.toggle_pause)
+        self.pause_btn.setEnabled(False)
+        playback_layout.addWidget(self.pause_btn)
+
+        self.stop_play_btn = QPushButton("■ Stop")
+        self.stop_play_btn.clicked.connect(self.stop_macro)
+        self.stop_play_btn.setEnabled(False)
+        playback_layout.addWidget(self.stop_play_btn)
+
+        self.stop_key_combo = QComboBox()
+        self.stop_key_combo.addItems([f"Stop key: {stop_key_label(name)}" for name in STOP_KEY_CHOICES])
+        self.stop_key_combo.setCurrentIndex(STOP_KEY_CHOICES.index(STOP_HOTKEY))
+        self.stop_key_combo.setToolTip("Key that stops all playback from anywhere. "
+                                       "Pick another to record macros that press Esc.")
+        self.stop_key_combo.currentIndexChanged.connect(self.set_stop_key)
+        playback_layout.addWidget(self.stop_key_combo)
+        self.set_stop_key(self.stop_key_combo.currentIndex())
         
         self.clear_btn = QPushButton("Clear Timeline")
         self.clear_btn.clicked.connect(self.clear_timeline)
@@ -438,23 +917,175 @@ class MacroEditor(QWidget):
         """)
         playback_layout.addWidget(self.clear_btn)
         
+        self.playback_lbl = QLabel("Idle")
+        self.playback_lbl.setStyleSheet("color: #cccccc;")
+        playback_layout.addWidget(self.playback_lbl)
+
+        self.latency_lbl = QLabel("Trigger latency: -")
+        self.latency_lbl.setStyleSheet("color: #cccccc;")
+        playback_layout.addWidget(self.latency_lbl)
+
+        playback_layout.addWidget(QLabel("On re-trigger:"))
+        self.policy_combo = QComboBox()
+        self.policy_combo.addItems([p.capitalize() for p in TRIGGER_POLICIES])
+        self.policy_combo.setToolTip("What to do when the hotkey fires while this macro is still playing")
+        self.policy_combo.currentIndexChanged.connect(self.set_trigger_policy)
+        playback_layout.addWidget(self.policy_combo)
+
+        self.instances_spin = QSpinBox()
+        self.instances_spin.setRange(1, 99)
+        self.instances_spin.setToolTip("Parallel: max instances at once. Queue: max pending triggers.")
+        self.instances_spin.valueChanged.connect(self.set_max_instances)
+        playback_layout.addWidget(self.instances_spin)
+
+        playback_layout.addWidget(QLabel("Move Hz:"))
+        self.move_rate_spin = QSpinBox()
+        self.move_rate_spin.setRange(10, 1000)
+        self.move_rate_spin.setToolTip("How often recorded mouse paths are sampled during playback")
+        self.move_rate_spin.valueChanged.connect(self.set_move_rate)
+        playback_layout.addWidget(self.move_rate_spin)
+
         playback_layout.addStretch()
+
+        self.stats_btn = QPushButton("Stats")
+        self.stats_btn.setCheckable(True)
+        self.stats_btn.setToolTip("Show trigger, lateness, injection and hook latency histograms")
+        playback_layout.addWidget(self.stats_btn)
         content_layout.addLayout(playback_layout)
 
+        # ----------------- PLAYBACK TIMING -----------------
+        # Applied when the macro is compiled, the recorded waits stay as they are
+        timing_layout = QHBoxLayout()
+        timing_layout.setSpacing(10)
+
+        timing_layout.addWidget(QLabel("Speed:"))
+        self.speed_spin = QDoubleSpinBox()
+        self.speed_spin.setRange(0.1, 100.0)
+        self.speed_spin.setSingleStep(0.25)
+        self.speed_spin.setSuffix("x")
+        self.speed_spin.setToolTip("Play waits and mouse paths this many times faster")
+        self.speed_spin.valueChanged.connect(self.set_speed)
+        timing_layout.addWidget(self.speed_spin)
+
+        timing_layout.addWidget(QLabel("Min wait:"))
+        self.min_wait_spin = QDoubleSpinBox()
+        self.min_wait_spin.setRange(0.0, 60000.0)
+        self.min_wait_spin.setDecimals(1)
+        self.min_wait_spin.setSuffix(" ms")
+        self.min_wait_spin.setSpecialValueText("Off")
+        self.min_wait_spin.setToolTip("Raise shorter waits to this")
+        self.min_wait_spin.valueChanged.connect(self.set_min_wait)
+        timing_layout.addWidget(self.min_wait_spin)
+
+        timing_layout.addWidget(QLabel("Max wait:"))
+        self.max_wait_spin = QDoubleSpinBox()
+        self.max_wait_spin.setRange(0.0, 600000.0)
+        self.max_wait_spin.setDecimals(1)
+        self.max_wait_spin.setSuffix(" ms")
+        self.max_wait_spin.setSpecialValueText("Off")
+        self.max_wait_spin.setToolTip("Cut longer waits, e.g. pauses while recording, down to this")
+        self.max_wait_spin.valueChanged.connect(self.set_max_wait)
+        timing_layout.addWidget(self.max_wait_spin)
+
+        timing_layout.addWidget(QLabel("Coalesce:"))
+        self.coalesce_spin = QDoubleSpinBox()
+        self.coalesce_spin.setRange(0.0, 10000.0)
+        self.coalesce_spin.setDecimals(1)
+        self.coalesce_spin.setSuffix(" ms")
+        self.coalesce_spin.setSpecialValueText("Off")
+        self.coalesce_spin.setToolTip("Fire steps closer together than this back to back; "
+                                      "their waits are added to the next longer one")
+        self.coalesce_spin.valueChanged.connect(self.set_coalesce)
+        timing_layout.addWidget(self.coalesce_spin)
+
+        self.turbo_chk = QCheckBox("Turbo")
+        self.turbo_chk.setToolTip("Ignore recorded waits and fire every step as fast as the OS accepts them")
+        self.turbo_chk.toggled.connect(self.set_turbo)
+        timing_layout.addWidget(self.turbo_chk)
+
+        self.batch_text_chk = QCheckBox("Batch typing")
+        self.batch_text_chk.setToolTip("Type runs of key taps a few ms apart or less as one block of text; "
+                                       "combine with Turbo or Coalesce for form filling")
+        self.batch_text_chk.toggled.connect(self.set_batch_text)
+        timing_layout.addWidget(self.batch_text_chk)
+
+        timing_layout.addStretch()
+        content_layout.addLayout(timing_layout)
+
+        # --------------------- REPEAT ----------------------
+        repeat_layout = QHBoxLayout()
+        repeat_layout.setSpacing(10)
+
+        repeat_layout.addWidget(QLabel("Repeat:"))
+        self.repeat_combo = QComboBox()
+        self.repeat_combo.addItems([REPEAT_LABELS[mode] for mode in REPEAT_MODES])
+        self.repeat_combo.setToolTip("Toggle: the hotkey starts and stops the loop")
+        self.repeat_combo.currentIndexChanged.connect(self.set_repeat_mode)
+        repeat_layout.addWidget(self.repeat_combo)
+
+        self.repeat_count_spin = QSpinBox()
+        self.repeat_count_spin.setRange(1, 1_000_000)
+        self.repeat_count_spin.setSuffix(" times")
+        self.repeat_count_spin.valueChanged.connect(self.set_repeat_count)
+        repeat_layout.addWidget(self.repeat_count_spin)
+
+        repeat_layout.addWidget(QLabel("Gap:"))
+        self.repeat_gap_spin = QDoubleSpinBox()
+        self.repeat_gap_spin.setRange(0.0, 3600000.0)
+        self.repeat_gap_spin.setDecimals(1)
+        self.repeat_gap_spin.setSuffix(" ms")
+        self.repeat_gap_spin.setToolTip("Pause between one repeat and the next")
+        self.repeat_gap_spin.valueChanged.connect(self.set_repeat_gap)
+        repeat_layout.addWidget(self.repeat_gap_spin)
+
+        repeat_layout.addWidget(QLabel("Rate limit:"))
+        self.rate_limit_spin = QDoubleSpinBox()
+        self.rate_limit_spin.setRange(0.0, 10000.0)
+        self.rate_limit_spin.setDecimals(1)
+        self.rate_limit_spin.setSuffix(" events/s")
+        self.rate_limit_spin.setSpecialValueText("Off")
+        self.rate_limit_spin.setToolTip("Never inject more than this many key, button and mouse events per second")
+        self.rate_limit_spin.valueChanged.connect(self.set_rate_limit)
+        repeat_layout.addWidget(self.rate_limit_spin)
+
+        repeat_layout.addStretch()
+        content_layout.addLayout(repeat_layout)
+
+        self.stats_panel = StatsPanel(self.runtime.metrics)
+        self.stats_panel.setVisible(False)
+        self.stats_btn.toggled.connect(self.stats_panel.setVisible)
+        content_layout.addWidget(self.stats_panel)
+
         content_widget.setLayout(content_layout)
         main_layout.addWidget(content_widget, 1)  # Give main content stretch factor
 
         self.setLayout(main_layout)
 
         # ---------------- LISTENERS SIGNALS ----------------
-        self.new_key_event.connect(self.add_keyblock)
-        self.new_mouse_event.connect(self.add_mouseblock)
+        timed = self.runtime.metrics.timed
+        self.input_listener = self.backend.listen(
+            on_key_press=timed("record_key", self.on_key),
+            on_key_release=timed("record_key", self.on_key_release),
+            on_click=timed("record_mouse", self.on_click),
+            on_move=timed("record_mouse", self.on_move),
+            on_scroll=timed("record_mouse", self.on_scroll),
+        )
 
-        self.key_listener = keyboard.Listener(on_press=self.on_key)
-        self.mouse_listener = mouse.Listener(on_click=self.on_click)
-        self.key_listener.start()
-        self.mouse_listener.start()
-        self.update_global_listener()
+        self.engine_signals.run_started.connect(self.on_playback_started)
+        self.engine_signals.run_finished.connect(self.on_playback_finished)
+        self.engine_signals.step_played.connect(self.on_step_played)
+        self.engine_signals.paused_changed.connect(self.on_playback_paused)
+        self.engine_signals.timing_report.connect(self.on_timing_report)
+        self.engine_signals.latency_measured.connect(self.on_latency_measured)
+        self.runtime.start()
+
+        self.engine_signals.triggered.connect(self.on_assigned_button_pressed)
+        self.engine_signals.captured.connect(self.on_button_captured)
+        self.dispatcher.start()
+        self.rebuild_hotkeys()
+        self.switch_profile(self.profiles[0])
+        if replayed and self.profile_library:
+            self.profile_library.compact(self.profiles)
 
     # -------------------------------------------------------
     #                     PROFILE MANAGEMENT
@@ -463,157 +1094,293 @@ class MacroEditor(QWidget):
         name, ok = QInputDialog.getText(self, "New Profile", "Enter profile name:", text=f"Macro {len(self.profiles) + 1}")
         if ok and name:
             new_profile = MacroProfile(name)
-            self.profiles.append(new_profile)
-            self.profile_list.addItem(name)
-            self.profile_list.setCurrentRow(len(self.profiles) - 1)
+            self.profile_model.append(new_profile)
+            self.autosave("add_profile", name=name)
+            self.switch_profile(new_profile)
 
     def rename_current_profile(self):
-        if not self.profiles:
+        current_profile = self.current_profile
+        if current_profile is None:
             return
-            
-        current_profile = self.profiles[self.current_profile_index]
+
         name, ok = QInputDialog.getText(self, "Rename Profile", "Enter new name:", text=current_profile.name)
         if ok and name:
             current_profile.name = name
-            self.profile_list.item(self.current_profile_index).setText(name)
+            self.autosave_settings(current_profile)
+            self.profile_model.profile_changed(current_profile)
             self.profile_name_label.setText(f"Profile: {name}")
+            self.rebuild_hotkeys()
 
     def delete_current_profile(self):
         if len(self.profiles) <= 1:
             QMessageBox.warning(self, "Cannot Delete", "You must have at least one profile.")
             return
-            
-        reply = QMessageBox.question(self, "Delete Profile", 
-                                    f"Are you sure you want to delete '{self.profiles[self.current_profile_index].name}'?",
+
+        removed = self.current_profile
+        reply = QMessageBox.question(self, "Delete Profile",
+                                    f"Are you sure you want to delete '{removed.name}'?",
                                     QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
-        
+
         if reply == QMessageBox.StandardButton.Yes:
-            if self.global_listener:
-                self.global_listener.stop()
-                self.is_listening = False
-            self.profiles.pop(self.current_profile_index)
-            self.profile_list.takeItem(self.current_profile_index)
-            self.current_profile_index = 0
-            self.profile_list.setCurrentRow(0)
-            self.switch_profile(0)
-
-    def switch_profile(self, index):
-        if index < 0 or index >= len(self.profiles):
-            return
-        self.save_current_profile_state()
-        self.current_profile_index = index
-        current_profile = self.profiles[index]
+            self.autosave("delete_profile", profile=self.profiles.index(removed))
+            self.profile_model.remove(removed)
+            if self.profile_library:
+                self.profile_library.forget(removed)
+            self.timeline_model.forget(removed)
+            self.switch_profile(self.profiles[0])
+            self.rebuild_hotkeys()
+
+    def on_profile_selected(self, current, previous):
+        if current.isValid():
+            profile = self.profiles[self.profile_proxy.mapToSource(current).row()]
+            if profile is not self.current_profile:
+                self.switch_profile(profile)
+
+    def switch_profile(self, current_profile):
+        self.current_profile = current_profile
+        # Follow in the sidebar, unless the search hides it
+        index = self.profile_proxy.mapFromSource(self.profile_model.index_of(current_profile))
+        if index.isValid() and index != self.profile_list.currentIndex():
+            self.profile_list.setCurrentIndex(index)
+        if self.timeline_model.profile is not current_profile:
+            self.optimize_lbl.setText("")
         self.profile_name_label.setText(f"Profile: {current_profile.name}")
-        if current_profile.assigned_label:
-            self.assigned_lbl.setText(f"Assigned: {current_profile.assigned_label}")
-        else:
-            self.assigned_lbl.setText("Assigned: None")
+        self.show_assigned(current_profile)
         self.macro_assigned_button = current_profile.assigned_button
-        while self.timeline_layout.count():
-            item = self.timeline_layout.takeAt(0)
-            if item.widget():
-                item.widget().deleteLater()
-        for text, wait_ms in current_profile.blocks:
-            blk = MacroBlock(text, wait_ms, self.remove_block)
-            self.timeline_layout.addWidget(blk)
-        self.update_global_listener()
-
-    def save_current_profile_state(self):
-        if not self.profiles:
-            return
-            
-        current_profile = self.profiles[self.current_profile_index]
-        current_profile.clear_blocks()
-        for i in range(self.timeline_layout.count()):
-            blk = self.timeline_layout.itemAt(i).widget()
-            if blk:
-                current_profile.add_block(blk.text, blk.wait_ms)
-        current_profile.assigned_button = self.macro_assigned_button
-        current_profile.assigned_label = self.assigned_lbl.text().replace("Assigned: ", "")
+        self.policy_combo.setCurrentIndex(TRIGGER_POLICIES.index(current_profile.trigger_policy))
+        self.instances_spin.setValue(current_profile.max_instances)
+        self.move_rate_spin.setValue(current_profile.move_rate_hz)
+        self.speed_spin.setValue(current_profile.speed)
+        self.min_wait_spin.setValue(current_profile.min_wait_ms)
+        self.max_wait_spin.setValue(current_profile.max_wait_ms)
+        self.coalesce_spin.setValue(current_profile.coalesce_ms)
+        self.turbo_chk.setChecked(current_profile.turbo)
+        self.batch_text_chk.setChecked(current_profile.batch_text)
+        self.repeat_combo.setCurrentIndex(REPEAT_MODES.index(current_profile.repeat_mode))
+        self.repeat_count_spin.setValue(current_profile.repeat_count)
+        self.repeat_count_spin.setEnabled(current_profile.repeat_mode == REPEAT_COUNT)
+        self.repeat_gap_spin.setValue(current_profile.repeat_gap_ms)
+        self.rate_limit_spin.setValue(current_profile.rate_limit)
+        if self.profile_library:
+            self.profile_library.touch(current_profile)
+        self.timeline_model.set_profile(current_profile)
 
     # -------------------------------------------------------
     #                     RECORDING
     # -------------------------------------------------------
     def start_record(self):
+        # Reset before the hooks see recording on; they own the filter state after
+        self.update_record_window()
+        self.record_filter.reset(excluded=set(self.dispatcher.bindings) | {self.dispatcher.stop_key})
         self.recording = True
         self.record_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
-        while self.timeline_layout.count():
-            item = self.timeline_layout.takeAt(0)
-            if item.widget():
-                item.widget().deleteLater()
         if self.profiles:
-            self.profiles[self.current_profile_index].clear_blocks()
-
-        self.last_event_time = time.time()
+            # One undo brings back whatever was there before this take
+            self.timeline_model.begin_group()
+            self.timeline_model.clear()
+        self.update_undo_buttons()
+
+        self.key_ring.drain()
+        self.mouse_ring.drain()
+        self.record_moves = self.record_moves_chk.isChecked()
+        self.last_move = None
+        self.last_move_pushed = True
+        self.last_move_push_ns = 0
+        self.stroke = []
+        self.last_event_ns = time.monotonic_ns()
+        self.record_timer.start()
 
     def stop_record(self):
         self.recording = False
+        self.record_timer.stop()
+        self.drain_recording(final=True)
+        if self.profiles:
+            self.timeline_model.end_group()
         self.record_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
+        self.update_undo_buttons()
+        dropped = self.record_filter.dropped()
+        if dropped:
+            reasons = ", ".join(f"{reason} {count}" for reason, count in sorted(dropped.items()))
+            print(f"Recording filter dropped {sum(dropped.values())} events ({reasons})")
+
+    def build_filter_menu(self):
+        menu = QMenu(self)
+        options = [
+            ("collapse_repeats", "Collapse key auto-repeat"),
+            ("ignore_window", "Ignore clicks on the KzMacro window"),
+            ("exclude_hotkeys", "Skip assigned hotkeys and the stop key"),
+        ]
+        for attr, label in options:
+            action = menu.addAction(label)
+            action.setCheckable(True)
+            action.setChecked(getattr(self.record_filter, attr))
+            action.toggled.connect(lambda checked, attr=attr: setattr(self.record_filter, attr, checked))
+
+        debounce_menu = menu.addMenu("Debounce re-presses")
+        group = QActionGroup(self)
+        for ms in DEBOUNCE_CHOICES_MS:
+            action = debounce_menu.addAction(f"Within {ms} ms" if ms else "Off")
+            action.setCheckable(True)
+            action.setChecked(ms == self.record_filter.debounce_ms)
+            action.triggered.connect(lambda _, ms=ms: setattr(self.record_filter, "debounce_ms", ms))
+            group.addAction(action)
+        return menu
+
+    def update_record_window(self):
+        # Hooks report physical screen pixels, Qt geometry is in logical ones
+        geometry = self.frameGeometry()
+        ratio = self.devicePixelRatioF()
+        self.record_filter.window_rect = (
+            geometry.left() * ratio, geometry.top() * ratio,
+            (geometry.right() + 1) * ratio, (geometry.bottom() + 1) * ratio,
+        )
 
-    def on_key(self, key):
-        if not self.recording:
-            return
+    def moveEvent(self, event):
+        self.update_record_window()
+        super().moveEvent(event)
 
-        try:
-            k = key.char
-        except:
-            k = str(key)
+    def resizeEvent(self, event):
+        self.update_record_window()
+        super().resizeEvent(event)
 
-        self.new_key_event.emit(k)
+    # Listener callbacks run on the hook threads: stamp the event first,
+    # then hand it to the GUI through the ring without touching Qt
+    def on_key(self, name):
+        now = time.monotonic_ns()
+        if self.recording and self.record_filter.key_down(name, now):
+            self.key_ring.push((now, f"Key {name} Down", None))
+
+    def on_key_release(self, name):
+        now = time.monotonic_ns()
+        if self.recording and self.record_filter.key_up(name, now):
+            self.key_ring.push((now, f"Key {name} Up", None))
 
     def on_click(self, x, y, button, pressed):
-        if not self.recording:
+        now = time.monotonic_ns()
+        if not (self.recording and self.record_filter.click(x, y, button, pressed, now)):
             return
 
+        self.flush_move()
         if pressed:
-            self.new_mouse_event.emit(f"{button} Down")
+            self.mouse_ring.push((now, f"{button} Down", None))
         else:
-            self.new_mouse_event.emit(f"{button} Up")
+            self.mouse_ring.push((now, f"{button} Up", None))
+
+    def on_move(self, x, y):
+        now = time.monotonic_ns()
+        if not (self.recording and self.record_moves and self.record_filter.move(x, y)):
+            return
+
+        self.last_move = (now, int(x), int(y))
+        self.last_move_pushed = False
+        if now - self.last_move_push_ns >= MOVE_MIN_INTERVAL_NS:
+            self.flush_move()
+
+    def on_scroll(self, x, y, dx, dy):
+        now = time.monotonic_ns()
+        if not (self.recording and self.record_filter.scroll(x, y)):
+            return
+
+        self.flush_move()
+        self.mouse_ring.push((now, f"Scroll {dx} {dy}", None))
+
+    def flush_move(self):
+        # Samples skipped by the min interval are still sent before a click,
+        # so the cursor ends up exactly where the button was pressed
+        if self.last_move is not None and not self.last_move_pushed:
+            ts, x, y = self.last_move
+            self.mouse_ring.push((ts, None, (x, y)))
+            self.last_move_pushed = True
+            self.last_move_push_ns = ts
 
     # -------------------------------------------------------
     #                         ADD BLOCKS
     # -------------------------------------------------------
-    def add_keyblock(self, keyname):
-        wait = int((time.time() - self.last_event_time) * 1000)
-        self.last_event_time = time.time()
-
-        blk = MacroBlock(f"Key {keyname}", wait, self.remove_block)
-        self.timeline_layout.addWidget(blk)
-        
-        # Save to current profile
-        if self.profiles:
-            self.profiles[self.current_profile_index].add_block(f"Key {keyname}", wait)
+    def drain_recording(self, final=False):
+        events = list(heapq.merge(self.key_ring.drain(), self.mouse_ring.drain(), key=lambda e: e[0]))
+        if final and self.last_move is not None and not self.last_move_pushed:
+            # Keep the last throttled sample; the ring has a single writer, so
+            # it is added here rather than pushed from the GUI thread
+            ts, x, y = self.last_move
+            events.append((ts, None, (x, y)))
+        if not self.profiles:
+            return
 
-    def add_mouseblock(self, txt):
-        wait = int((time.time() - self.last_event_time) * 1000)
-        self.last_event_time = time.time()
+        blocks = []
+        for ts_ns, text, position in events:
+            if position is not None:
+                if self.stroke and ts_ns - self.stroke[-1][0] > STROKE_GAP_NS:
+                    self.finish_stroke(blocks)
+                self.stroke.append((ts_ns, *position))
+                continue
+            self.finish_stroke(blocks)
+            self.add_recorded_block(blocks, text, ts_ns)
+
+        # Keep the stroke open across drains unless the mouse has gone idle
+        if self.stroke and (final or time.monotonic_ns() - self.stroke[-1][0] > STROKE_GAP_NS):
+            self.finish_stroke(blocks)
+        if blocks:
+            self.timeline_model.append_blocks(blocks)
+
+        dropped = self.key_ring.dropped + self.mouse_ring.dropped
+        if dropped:
+            print(f"Recording buffer overflowed, {dropped} events dropped")
+            self.key_ring.dropped = self.mouse_ring.dropped = 0
+
+    def add_recorded_block(self, blocks, text, ts_ns):
+        wait_us = max(0, ts_ns - self.last_event_ns) // 1000
+        blocks.append((text, wait_us / 1000))
+        self.last_event_ns = ts_ns
+
+    def finish_stroke(self, blocks):
+        if self.stroke:
+            points = simplify_path(self.stroke)
+            self.add_recorded_block(blocks, encode_move(points), points[0][0])
+            self.stroke = []
 
-        blk = MacroBlock(txt, wait, self.remove_block)
-        self.timeline_layout.addWidget(blk)
+    # -------------------------------------------------------
+    def clear_timeline(self):
         if self.profiles:
-            self.profiles[self.current_profile_index].add_block(txt, wait)
+            self.timeline_model.clear()
 
     # -------------------------------------------------------
-    def remove_block(self, block):
-        if self.profiles:
-            profile = self.profiles[self.current_profile_index]
-            for i, (text, wait) in enumerate(profile.blocks):
-                if text == block.text and wait == block.wait_ms:
-                    profile.remove_block(i)
-                    break
-        
-        block.setParent(None)
-        block.deleteLater()
+    #                       OPTIMIZE
+    # -------------------------------------------------------
+    def optimize_profile(self):
+        profile = self.current_profile
+        if profile is None:
+            return
+        before = profile.blocks
+        optimized = optimize_blocks(before)
+        if len(optimized) >= len(before):
+            self.optimize_lbl.setText("Nothing to optimize")
+            return
+        runtime_before = estimate_runtime_ms(before)
+        runtime_after = estimate_runtime_ms(optimized)
+        self.timeline_model.replace_blocks(optimized)
+        self.optimize_lbl.setText(
+            f"{len(before)} -> {len(profile.blocks)} steps, "
+            f"runtime {format_runtime(runtime_before)} -> {format_runtime(runtime_after)}"
+        )
 
-    def clear_timeline(self):
-        while self.timeline_layout.count():
-            item = self.timeline_layout.takeAt(0)
-            if item.widget():
-                item.widget().deleteLater()
-        if self.profiles:
-            self.profiles[self.current_profile_index].clear_blocks()
+    # -------------------------------------------------------
+    #                     UNDO / REDO
+    # -------------------------------------------------------
+    def undo_edit(self):
+        if self.profiles and not self.recording:
+            self.timeline_model.undo()
+            self.optimize_lbl.setText("")
+
+    def redo_edit(self):
+        if self.profiles and not self.recording:
+            self.timeline_model.redo()
+            self.optimize_lbl.setText("")
+
+    def update_undo_buttons(self):
+        self.undo_btn.setEnabled(not self.recording and self.timeline_model.can_undo())
+        self.redo_btn.setEnabled(not self.recording and self.timeline_model.can_redo())
 
     # -------------------------------------------------------
     #         ASSIGN MACRO TO KEY OR MOUSE BUTTON
@@ -621,221 +1388,302 @@ class MacroEditor(QWidget):
     def assign_button(self):
         self.assigned_lbl.setText("Press any key or mouse button...")
         self.recording = False
-        
-        # Stop existing listener
-        if self.global_listener:
-            self.global_listener.stop()
-            self.is_listening = False
-
-        def on_key_assign(key):
-            try:
-                assigned = key.char
-            except:
-                assigned = str(key)
-
-            self.macro_assigned_button = assigned
-            display_name = assigned.replace("Key.", "")
-            self.assigned_lbl.setText(f"Assigned: {display_name}")
-            if self.profiles:
-                self.profiles[self.current_profile_index].assigned_button = assigned
-                self.profiles[self.current_profile_index].assigned_label = display_name
-            self.update_global_listener()
-            
-            key_listener.stop()
-            mouse_listener.stop()
-
-        def on_mouse_assign(x, y, button, pressed):
-            if not pressed:
-                return
-                
-            assigned = str(button)
-            self.macro_assigned_button = assigned
-            display_name = assigned.replace("Button.", "")
-            self.assigned_lbl.setText(f"Assigned: {display_name}")
-            if self.profiles:
-                self.profiles[self.current_profile_index].assigned_button = assigned
-                self.profiles[self.current_profile_index].assigned_label = display_name
-            self.update_global_listener()
-            
-            key_listener.stop()
-            mouse_listener.stop()
-        key_listener = keyboard.Listener(on_press=on_key_assign)
-        mouse_listener = mouse.Listener(on_click=on_mouse_assign)
-        
-        key_listener.start()
-        mouse_listener.start()
+        self.dispatcher.capture_next()
+
+    def on_button_captured(self, assigned):
+        self.macro_assigned_button = assigned
+        display_name = assigned.replace("Key.", "").replace("Button.", "")
+        profile = self.current_profile
+        profile.assigned_button = assigned
+        profile.assigned_label = display_name
+        self.autosave_settings(profile)
+        self.profile_model.profile_changed(profile)
+        self.rebuild_hotkeys()  # Flags a hotkey another profile already has
+        self.show_assigned(profile)
 
     # -------------------------------------------------------
-    #           UPDATE GLOBAL LISTENER
+    #           UPDATE GLOBAL HOTKEYS
     # -------------------------------------------------------
-    def update_global_listener(self):
-        if self.global_listener:
-            self.global_listener.stop()
-            self.global_listener.wait(1000)
-        current_profile = self.profiles[self.current_profile_index]
-        assigned_button = current_profile.assigned_button
-        
-        if assigned_button:
-            self.macro_assigned_button = assigned_button
-            self.global_listener = GlobalKeyListener()
-            self.global_listener.set_assigned_button(assigned_button)
-            self.global_listener.key_pressed.connect(self.on_assigned_button_pressed)
-            self.global_listener.start()
-            self.is_listening = True
+    def rebuild_hotkeys(self):
+        # Only swaps the lookup table, the OS hooks keep running
+        conflicts = self.dispatcher.rebuild(self.profiles)
+        self.profile_model.set_conflicts(conflicts)
+        if conflicts:
+            shared = sum(len(owners) for owners in conflicts.values())
+            keys = ", ".join(owners[0].assigned_label for owners in list(conflicts.values())[:5])
+            if len(conflicts) > 5:
+                keys += ", ..."
+            self.conflict_lbl.setText(f"⚠ {shared} profiles share hotkeys ({keys}); "
+                                      "only the first in the list plays")
         else:
-            self.global_listener = None
-            self.is_listening = False
+            self.conflict_lbl.setText("")
+
+    def show_assigned(self, profile):
+        if not profile.assigned_button:
+            self.assigned_lbl.setText("Assigned: None")
+            return
+        others = self.profile_model.conflicts.get(profile)
+        if others:
+            names = ", ".join(other.name for other in others)
+            self.assigned_lbl.setText(f"Assigned: {profile.assigned_label} (also on {names})")
+            self.assigned_lbl.setStyleSheet("font-size: 14px; color: #ffb347;")
+        else:
+            self.assigned_lbl.setText(f"Assigned: {profile.assigned_label}")
+            self.assigned_lbl.setStyleSheet("font-size: 14px; color: #2cff88;")
 
     # -------------------------------------------------------
     #           HANDLE ASSIGNED BUTTON PRESS
     # -------------------------------------------------------
-    def on_assigned_button_pressed(self, button_str):
-        print(f"Assigned button pressed: {button_str}")
-        self.play_macro()
+    def on_assigned_button_pressed(self, profile, started):
+        if self.profile_library:
+            # Playback decodes it if it was still mapped: keep it from being evicted
+            self.profile_library.touch(profile)
+        print(f"Assigned button pressed: {profile.assigned_button} -> {profile.name}")
+        if not started:
+            if profile.repeat_mode == REPEAT_TOGGLE:
+                print("Loop toggled off")
+            else:
+                print("Macro already playing, trigger ignored")
 
     # -------------------------------------------------------
     #                 MACRO PLAYBACK LOGIC
     # -------------------------------------------------------
-    def play_macro(self):
-        if not self.profiles or not self.profiles[self.current_profile_index].blocks:
+    def play_macro(self, profile=None):
+        if profile is None:
+            profile = self.current_profile
+        if profile is None or not profile.blocks:
             print("No macro to play")
             return
-            
-        from pynput.keyboard import Controller, Key
-        from pynput.mouse import Controller as MController, Button
-
-        k = Controller()
-        m = MController()
-
-        print(f"Playing macro: {self.profiles[self.current_profile_index].name}")
-        current_profile = self.profiles[self.current_profile_index]
-        for i, (text, wait_ms) in enumerate(current_profile.blocks):
-            if i > 0:
-                time.sleep(wait_ms / 1000)
-
-            if text.startswith("Key"):
-                keyname = text.split(" ")[1]
-                try:
-                    if hasattr(Key, keyname.lower()):
-                        key_obj = getattr(Key, keyname.lower())
-                        k.press(key_obj)
-                        time.sleep(0.02)
-                        k.release(key_obj)
-                    else:
-                        k.press(keyname)
-                        time.sleep(0.02)
-                        k.release(keyname)
-                except Exception as e:
-                    print(f"Error pressing key {keyname}: {e}")
-
-            elif "Button.left" in text:
-                if "down" in text:
-                    m.press(Button.left)
-                elif "up" in text:
-                    m.release(Button.left)
-                else:
-                    m.press(Button.left)
-                    time.sleep(0.02)
-                    m.release(Button.left)
-
-            elif "Button.right" in text:
-                if "down" in text:
-                    m.press(Button.right)
-                elif "up" in text:
-                    m.release(Button.right)
-                else:
-                    m.press(Button.right)
-                    time.sleep(0.02)
-                    m.release(Button.right)
-
-            elif "Button.middle" in text:
-                if "down" in text:
-                    m.press(Button.middle)
-                elif "up" in text:
-                    m.release(Button.middle)
-                else:
-                    m.press(Button.middle)
-                    time.sleep(0.02)
-                    m.release(Button.middle)
-                    
-            elif "Button.x" in text:
-                # Handle mouse buttons X1 and X2 (usually side buttons)
-                if "x1" in text.lower():
-                    if "down" in text:
-                        m.press(Button.x1)
-                    elif "up" in text:
-                        m.release(Button.x1)
-                    else:
-                        m.press(Button.x1)
-                        time.sleep(0.02)
-                        m.release(Button.x1)
-                elif "x2" in text.lower():
-                    if "down" in text:
-                        m.press(Button.x2)
-                    elif "up" in text:
-                        m.release(Button.x2)
-                    else:
-                        m.press(Button.x2)
-                        time.sleep(0.02)
-                        m.release(Button.x2)
+        if self.profile_library:
+            self.profile_library.touch(profile)
+        if not self.runtime.trigger(profile):
+            print(f"Macro already playing ({profile.trigger_policy}), trigger ignored")
+
+    def stop_macro(self):
+        self.runtime.stop()
+
+    def set_stop_key(self, index):
+        name = STOP_KEY_CHOICES[index]
+        self.dispatcher.set_stop_key(name)
+        self.stop_play_btn.setToolTip(f"Stop playback ({stop_key_label(name)})" if name else "Stop playback")
+
+    def toggle_pause(self):
+        if self.runtime.is_busy():
+            self.runtime.set_paused(not self.runtime.is_paused())
+
+    def set_trigger_policy(self, index):
+        self.set_profile_setting("trigger_policy", TRIGGER_POLICIES[index])
+
+    def set_max_instances(self, value):
+        self.set_profile_setting("max_instances", value)
+
+    def set_move_rate(self, value):
+        self.set_profile_setting("move_rate_hz", value)
+
+    def set_speed(self, value):
+        self.set_profile_setting("speed", value)
+
+    def set_min_wait(self, value):
+        self.set_profile_setting("min_wait_ms", value)
+
+    def set_max_wait(self, value):
+        self.set_profile_setting("max_wait_ms", value)
+
+    def set_coalesce(self, value):
+        self.set_profile_setting("coalesce_ms", value)
+
+    def set_turbo(self, checked):
+        # Turbo overrides every other timing option
+        for spin in (self.speed_spin, self.min_wait_spin, self.max_wait_spin, self.coalesce_spin):
+            spin.setEnabled(not checked)
+        self.set_profile_setting("turbo", checked)
+
+    def set_batch_text(self, checked):
+        self.set_profile_setting("batch_text", checked)
+
+    def set_repeat_mode(self, index):
+        self.repeat_count_spin.setEnabled(REPEAT_MODES[index] == REPEAT_COUNT)
+        self.set_profile_setting("repeat_mode", REPEAT_MODES[index])
+
+    def set_repeat_count(self, value):
+        self.set_profile_setting("repeat_count", value)
+
+    def set_repeat_gap(self, value):
+        self.set_profile_setting("repeat_gap_ms", value)
+
+    def set_rate_limit(self, value):
+        self.set_profile_setting("rate_limit", value)
+
+    def set_profile_setting(self, name, value):
+        # switch_profile sets the widgets too, only journal real changes
+        profile = self.current_profile
+        if profile is not None:
+            if getattr(profile, name) != value:
+                setattr(profile, name, value)
+                self.autosave_settings(profile)
+
+    def on_playback_started(self, run_id, name):
+        print(f"Playing macro: {name}")
+        self.active_runs[run_id] = (name, 0, 0)
+        self.pause_btn.setEnabled(True)
+        self.stop_play_btn.setEnabled(True)
+        self.update_playback_label()
+
+    def on_step_played(self, run_id, done, total):
+        if run_id in self.active_runs:
+            self.active_runs[run_id] = (self.active_runs[run_id][0], done, total)
+            self.update_playback_label()
+
+    def on_latency_measured(self, latency_ms):
+        history = self.runtime.latencies_ms
+        average = sum(history) / len(history)
+        self.latency_lbl.setText(f"Trigger latency: {latency_ms:.3f} ms (avg {average:.3f} ms)")
+
+    def on_playback_paused(self, paused):
+        self.pause_btn.setText("▶ Resume" if paused else "❚❚ Pause")
+
+    def on_timing_report(self, name, report):
+        self.last_timing_report = report
+
+    def on_playback_finished(self, run_id, name):
+        self.active_runs.pop(run_id, None)
+        if not self.active_runs:
+            self.pause_btn.setEnabled(False)
+            self.pause_btn.setText("❚❚ Pause")
+            self.stop_play_btn.setEnabled(False)
+        self.update_playback_label()
+
+    def update_playback_label(self):
+        if len(self.active_runs) == 1:
+            name, done, total = next(iter(self.active_runs.values()))
+            self.playback_lbl.setText(f"Playing {name} {done}/{total}")
+        elif self.active_runs:
+            self.playback_lbl.setText(f"Playing {len(self.active_runs)} macros")
+        elif self.last_timing_report:
+            self.playback_lbl.setText(f"Last run: {self.last_timing_report}")
+        else:
+            self.playback_lbl.setText("Idle")
 
     # -------------------------------------------------------
     #                     SAVE/LOAD PROFILES
     # -------------------------------------------------------
     def save_profiles(self):
-        file_path, _ = QFileDialog.getSaveFileName(
-            self, "Save Profiles", "", "JSON Files (*.json)"
+        file_path, selected_filter = QFileDialog.getSaveFileName(
+            self, "Save Profiles", "", "KzMacro Library (*.kzm);;JSON Files (*.json)"
         )
         
         if file_path:
-            if not file_path.endswith('.json'):
-                file_path += '.json'
+            if not file_path.lower().endswith(('.kzm', '.json')):
+                file_path += '.kzm' if 'kzm' in selected_filter else '.json'
                 
             try:
-                self.save_current_profile_state()
-                
-                profiles_data = [profile.to_dict() for profile in self.profiles]
-                with open(file_path, 'w') as f:
-                    json.dump(profiles_data, f, indent=2)
+                if is_binary_library(file_path):
+                    # Decode everything still mapped before the file can be replaced
+                    self.close_library()
+                    write_binary_library(file_path, self.profiles)
+                else:
+                    with open(file_path, 'w') as f:
+                        json.dump(profiles_to_json(self.profiles), f, indent=2)
                 QMessageBox.information(self, "Success", "Profiles saved successfully!")
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to save: {str(e)}")
 
     def load_profiles(self):
         file_path, _ = QFileDialog.getOpenFileName(
-            self, "Load Profiles", "", "JSON Files (*.json)"
+            self, "Load Profiles", "",
+            "Macro Files (*.kzm *.json);;KzMacro Library (*.kzm);;JSON Files (*.json)"
         )
         
         if file_path:
             try:
-                with open(file_path, 'r') as f:
-                    profiles_data = json.load(f)
-                self.profiles.clear()
-                self.profile_list.clear()
-                for data in profiles_data:
-                    profile = MacroProfile.from_dict(data)
-                    self.profiles.append(profile)
-                    self.profile_list.addItem(profile.name)
+                library = None
+                if is_binary_library(file_path):
+                    library = BinaryLibrary(file_path)
+                    profiles = library.profiles
+                else:
+                    with open(file_path, 'r') as f:
+                        profiles = profiles_from_json(json.load(f))
+                old_library, self.library = self.library, library
+                self.timeline_model.forget_all()
+                self.profile_model.replace(profiles)
+                self.rebuild_hotkeys()
                 if self.profiles:
-                    self.profile_list.setCurrentRow(0)
-                    self.switch_profile(0)
+                    self.switch_profile(self.profiles[0])
+                if self.profile_library:
+                    # An earlier compaction may still be decoding from the old
+                    # file, and this one must not be skipped for it
+                    self.profile_library.wait()
+                if old_library is not None:
+                    # Nothing can reach the replaced profiles any more
+                    old_library.close()
+                if self.profile_library:
+                    # Profiles still mapped are decoded on the writer thread
+                    self.profile_library.replace_all(self.profiles, file_path if library is not None else None)
                     
                 QMessageBox.information(self, "Success", "Profiles loaded successfully!")
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to load: {str(e)}")
 
+    def close_library(self):
+        if self.library is not None:
+            if self.profile_library:
+                self.profile_library.wait()  # May be decoding from the file
+            self.library.load_all()
+            self.library.close()
+            self.library = None
+
+    # -------------------------------------------------------
+    #                       AUTOSAVE
+    # -------------------------------------------------------
+    def autosave(self, op, **fields):
+        if self.profile_library is None:
+            return
+        try:
+            self.profile_library.append(op, **fields)
+            if self.profile_library.needs_compaction():
+                self.profile_library.compact(self.profiles)
+        except Exception as e:
+            print(f"Autosave failed: {e}")
+
+    def autosave_settings(self, profile):
+        self.autosave("settings", profile=self.profiles.index(profile), settings=profile.settings_dict())
+
+    def on_blocks_inserted(self, profile, first, count):
+        blocks = profile.blocks
+        texts = blocks.texts
+        last = first + count
+        added = [
+            [texts[text_id], wait_us]
+            for text_id, wait_us in zip(blocks.text_ids[first:last], blocks.waits_us[first:last])
+        ]
+        if last == len(blocks):
+            self.autosave("add_blocks", profile=self.profiles.index(profile), blocks=added)
+        else:
+            self.autosave("insert_blocks", profile=self.profiles.index(profile), index=first, blocks=added)
+
+    def on_blocks_removed(self, profile, first, count):
+        if count == 1:
+            self.autosave("remove_block", profile=self.profiles.index(profile), index=first)
+        else:
+            self.autosave("remove_blocks", profile=self.profiles.index(profile), index=first, count=count)
+
+    def on_blocks_cleared(self, profile):
+        self.autosave("clear_blocks", profile=self.profiles.index(profile))
+
     # -------------------------------------------------------
     #                   CLEANUP ON CLOSE
     # -------------------------------------------------------
     def closeEvent(self, event):
-        self.save_current_profile_state()
-        
-        if self.global_listener:
-            self.global_listener.stop()
-        if self.key_listener:
-            self.key_listener.stop()
-        if self.mouse_listener:
-            self.mouse_listener.stop()
+        self.runtime.shutdown()
+        self.dispatcher.stop()
+        if self.profile_library:
+            # Fold this session's journal into the library so the next start
+            # only has to read the index
+            self.profile_library.compact(self.profiles)
+            self.profile_library.close()
+        if self.library is not None:
+            self.library.close()
+        self.input_listener.stop()
         event.accept()
 
 
@@ -851,4 +1699,4 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Error starting application: {e}")
         import traceback
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()